@@ -89,10 +89,18 @@ management with proper approval controls.
     'website': 'https://github.com/zanello1234',
     'support': 'https://github.com/zanello1234/custom_bom_approval_flow',
     'category': 'Sales/Sales',
-    'depends': ['sale'],
+    'depends': ['sale', 'sale_mrp'],
     'data': [
+        'security/ir.model.access.csv',
+        'security/sale_order_approval_security.xml',
         'views/sale_order_views.xml',
         'views/sale_order_bom_customization_menu.xml',
+        'views/res_config_settings_views.xml',
+        'views/sale_order_confirm_metric_views.xml',
+        'views/sale_order_approval_pipeline_views.xml',
+        'wizard/sale_order_kit_availability_views.xml',
+        'data/sale_order_server_actions.xml',
+        'data/ir_cron.xml',
     ],
     'demo': [],
     'images': [
@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from . import res_company
+from . import res_config_settings
 from . import sale_order
 from . import sale_order_line
+from . import sale_order_line_kit_component
 from . import mrp_bom
+from . import mrp_bom_flattened
+from . import sale_order_confirm_job
+from . import sale_order_confirm_metric
+from . import sale_order_approval_pipeline
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, SUPERUSER_ID
+from collections import deque
+from contextlib import contextmanager
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# In-memory ring buffer of confirmation phase timings, one per database.
+# Flushed into sale.order.confirm.metric after a commit, at most every
+# METRICS_FLUSH_INTERVAL seconds or once METRICS_FLUSH_SIZE samples are waiting.
+METRICS_BUFFER_SIZE = 10000
+METRICS_FLUSH_INTERVAL = 60
+METRICS_FLUSH_SIZE = 500
+_metrics_buffers = {}
+_metrics_last_flush = {}
+
+
+class KitTrace:
+    """
+    Tracing of KIT expansions. Per-component detail goes to DEBUG with lazy
+    formatting; when tracing is enabled for the company, one INFO summary
+    record is emitted per sale order line with its counts and timing.
+    """
+
+    def __init__(self, company):
+        self.enabled = bool(company.kit_trace_enabled)
+
+    @staticmethod
+    def debug_enabled():
+        return _logger.isEnabledFor(logging.DEBUG)
+
+    @staticmethod
+    def debug(msg, *args):
+        _logger.debug(msg, *args)
+
+    @contextmanager
+    def line(self, sale_line, bom):
+        """Time the expansion of one sale order line; the caller fills stats['components']"""
+        stats = {'components': 0}
+        if not self.enabled:
+            yield stats
+            return
+        start = time.perf_counter()
+        yield stats
+        _logger.info(
+            "kit_expand line=%s order=%s product=%s bom=%s components=%s duration_ms=%.2f",
+            sale_line.id, sale_line.order_id.id, sale_line.product_id.id, bom.id,
+            stats['components'], (time.perf_counter() - start) * 1000.0,
+        )
+
+
+@contextmanager
+def record_phase(env, phase, orders=None):
+    """
+    Measure wall time and SQL query count of a confirmation phase into the
+    metrics ring buffer; the caller may fill stats['components']. Samples
+    are attributed to the company of the measured orders, or to the
+    current company when these belong to several companies.
+    """
+    stats = {'components': 0}
+    cr = env.cr
+    start = time.perf_counter()
+    start_queries = getattr(cr, 'sql_log_count', 0)
+    yield stats
+    order = orders[:1] if orders is not None and len(orders) == 1 else None
+    companies = orders.company_id if orders is not None else None
+    company = companies if companies is not None and len(companies) == 1 else env.company
+    dbname = cr.dbname
+    buffer = _metrics_buffers.get(dbname)
+    if buffer is None:
+        buffer = _metrics_buffers.setdefault(dbname, deque(maxlen=METRICS_BUFFER_SIZE))
+    buffer.append({
+        'phase': phase,
+        'order_id': order.id if order else False,
+        'company_id': company.id,
+        'duration_ms': (time.perf_counter() - start) * 1000.0,
+        'query_count': getattr(cr, 'sql_log_count', 0) - start_queries,
+        'component_count': stats['components'],
+    })
+    now = time.monotonic()
+    if len(buffer) >= METRICS_FLUSH_SIZE or now - _metrics_last_flush.get(dbname, 0) >= METRICS_FLUSH_INTERVAL:
+        _metrics_last_flush[dbname] = now
+        registry = env.registry
+        cr.postcommit.add(lambda: flush_metrics(registry))
+
+
+def flush_metrics(registry):
+    """Move the buffered samples of a database into sale.order.confirm.metric"""
+    buffer = _metrics_buffers.get(registry.db_name)
+    samples = []
+    while buffer:
+        try:
+            samples.append(buffer.popleft())
+        except IndexError:
+            break
+    if not samples:
+        return
+    try:
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['sale.order.confirm.metric']._create_from_samples(samples)
+    except Exception:
+        _logger.warning("Could not flush %s confirmation metrics", len(samples), exc_info=True)
@@ -1,69 +1,364 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools.sql import column_exists, create_index, drop_index
+from array import array
 import logging
 
+from .kit_trace import KitTrace
+
 _logger = logging.getLogger(__name__)
 
+# Key of the per-transaction KIT explosion memo in cr.precommit.data
+KIT_EXPLOSION_CACHE = 'sale_order_approval.kit_explosions'
+# Key of the per-transaction flexible BOM lookups of _bom_find in cr.precommit.data
+BOM_FIND_CACHE = 'sale_order_approval.bom_find'
+
+# Default maximum number of nested KIT levels (sale_order_approval.kit_max_depth)
+DEFAULT_KIT_MAX_DEPTH = 50
+
+# mrp.bom fields that change which BOM _bom_find picks, or what it explodes to
+KIT_BOM_FIELDS = {
+    'active', 'bom_line_ids', 'company_id', 'picking_type_id', 'product_id',
+    'product_qty', 'product_tmpl_id', 'product_uom_id', 'sequence', 'type',
+}
+
 
 class MrpBom(models.Model):
     _inherit = 'mrp.bom'
 
+    kit_revision = fields.Integer(
+        string='KIT Revision', copy=False, readonly=True,
+        help="Bumped whenever the BOM or the BOM of one of its components changes (mrp.bom.flattened)",
+    )
+
+    def init(self):
+        super().init()
+        # Latest flexible BOM of a product (sale.order._get_flexible_bom_by_product)
+        if column_exists(self.env.cr, self._table, 'is_flexible_bom'):
+            drop_index(self.env.cr, 'mrp_bom_flexible_product_create_date_index', self._table)
+            create_index(
+                self.env.cr, 'mrp_bom_flexible_product_id_index', self._table,
+                ['product_id', 'id'], where='is_flexible_bom',
+            )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        boms = super().create(vals_list)
+        # A product that used to be a leaf may have just become a KIT
+        self.env['mrp.bom.flattened']._invalidate(product_ids=boms._get_kit_dependency_product_ids())
+        return boms
+
+    def write(self, vals):
+        if not KIT_BOM_FIELDS.intersection(vals):
+            return super().write(vals)
+        product_ids = self._get_kit_dependency_product_ids()
+        res = super().write(vals)
+        product_ids |= self._get_kit_dependency_product_ids()
+        self.env['mrp.bom.flattened']._invalidate(self.ids, product_ids)
+        return res
+
+    def unlink(self):
+        self.env['mrp.bom.flattened']._invalidate(self.ids, self._get_kit_dependency_product_ids())
+        return super().unlink()
+
+    def _get_kit_dependency_product_ids(self):
+        """Ids of the product variants these BOMs can be found for"""
+        product_ids = set()
+        for bom in self.with_context(active_test=False):
+            if bom.product_id:
+                product_ids.add(bom.product_id.id)
+            else:
+                product_ids.update(bom.product_tmpl_id.product_variant_ids.ids)
+        return product_ids
+
     @api.model
     def _bom_find(self, products=None, **kwargs):
         """
-        Override BOM search to prioritize flexible BOMs when in sale order context
+        Override BOM search to prioritize flexible BOMs when in sale order context.
+        Returns the {product: bom} mapping of the standard method, with the
+        flexible BOM designated by the context merged in for every product
+        it applies to.
         """
-        # Handle both old and new method signatures
-        product_tmpl = kwargs.get('product_tmpl')
-        product = kwargs.get('product')
+        sale_line_id = self.env.context.get('sale_line_id')
+        flexible_bom_id = self.env.context.get('flexible_bom_id')
         
-        # If products parameter is provided (new signature), extract product from it
-        if products and not product and not product_tmpl:
-            if hasattr(products, '__iter__'):
-                product = products[0] if products else None
-            else:
-                product = products
+        # Old signature - reconstruct products from individual parameters
+        product_tmpl = kwargs.pop('product_tmpl', None)
+        product = kwargs.pop('product', None)
+        if products is None:
+            products = product or (product_tmpl and product_tmpl.product_variant_ids) or self.env['product.product']
         
-        # First check if we're in a context where flexible BOM should be used
-        sale_line_id = self.env.context.get('sale_line_id')
+        bom_by_product = super()._bom_find(products, **kwargs)
+        
+        # Outside of a flexible BOM context (MRP scheduler, stock rules, ...)
+        # this override has nothing to add
+        if not sale_line_id and not flexible_bom_id:
+            return bom_by_product
+        
+        flexible_bom = self._get_context_flexible_bom()
+        if flexible_bom:
+            for product in products:
+                if flexible_bom.product_id == product or \
+                   (not flexible_bom.product_id and flexible_bom.product_tmpl_id == product.product_tmpl_id):
+                    bom_by_product[product] = flexible_bom
+        return bom_by_product
+
+    @api.model
+    def _get_context_flexible_bom(self):
+        """
+        Flexible BOM designated by the context, if any. Resolved once per
+        context key and transaction.
+        """
         flexible_bom_id = self.env.context.get('flexible_bom_id')
+        sale_line_id = self.env.context.get('sale_line_id')
+        key = ('flexible_bom_id', flexible_bom_id) if flexible_bom_id else ('sale_line_id', sale_line_id)
+        cache = self._get_transaction_cache(BOM_FIND_CACHE)
+        if key in cache:
+            return self.browse(cache[key])
         
+        flexible_bom = self.browse()
         if flexible_bom_id:
-            flexible_bom = self.browse(flexible_bom_id)
-            if flexible_bom.exists():
-                _logger.info(f"🎯 Using flexible BOM from context: {flexible_bom.display_name}")
-                return flexible_bom
-        
-        if sale_line_id:
-            sale_line = self.env['sale.order.line'].browse(sale_line_id)
-            if sale_line.exists() and hasattr(sale_line, 'flexible_bom_id') and sale_line.flexible_bom_id:
-                # Check if the flexible BOM matches the product we're looking for
+            flexible_bom = self.browse(flexible_bom_id).exists()
+            if flexible_bom:
+                _logger.debug("Using flexible BOM %s from context", flexible_bom.id)
+        elif sale_line_id:
+            sale_line = self.env['sale.order.line'].browse(sale_line_id).exists()
+            if sale_line and hasattr(sale_line, 'flexible_bom_id') and sale_line.flexible_bom_id:
                 flexible_bom = sale_line.flexible_bom_id
-                if (product and flexible_bom.product_id == product) or \
-                   (product_tmpl and flexible_bom.product_tmpl_id == product_tmpl):
-                    _logger.info(f"🎯 Using flexible BOM from sale line: {flexible_bom.display_name}")
-                    return flexible_bom
-        
-        # If no flexible BOM context, use standard logic
-        try:
-            if products is not None:
-                # New signature with products parameter
-                return super()._bom_find(products, **{k: v for k, v in kwargs.items() if k not in ['product_tmpl', 'product']})
+                _logger.debug("Using flexible BOM %s from sale line %s", flexible_bom.id, sale_line_id)
+        cache[key] = flexible_bom.id
+        return flexible_bom
+
+    def _get_transaction_cache(self, name):
+        """
+        Return a dict cached in the cursor's precommit data under the given
+        name. It is dropped on commit and rollback, but also when a savepoint
+        is rolled back (or entered), so entries computed from BOM data that
+        a savepoint rollback undid are never reused.
+        """
+        return self.env.cr.precommit.data.setdefault(name, {})
+
+    def _get_kit_explosion_cache(self):
+        """
+        Return the per-transaction memo of flattened KIT explosions,
+        keyed by (bom_id, company_id).
+        """
+        return self._get_transaction_cache(KIT_EXPLOSION_CACHE)
+
+    def _explode_kit_flat(self, company_id=False):
+        """
+        Flatten this KIT BOM into its leaf components for one unit of the kit.
+        Returns a tuple of (product_id, qty_per_unit) pairs, memoized per
+        (bom_id, company_id) for the rest of the transaction.
+        """
+        self.ensure_one()
+        return self._get_kit_flat_entries(company_id)[self.id][0]
+
+    def _get_kit_flat_entries(self, company_id=False, compute=True):
+        """
+        Flattened explosion of each BOM, as a dict {bom_id: (components,
+        bom_ids, product_ids)}: the (product_id, qty_per_unit) tuple plus the
+        sub-BOMs and looked-up products it depends on. Entries come from the
+        transaction memo, then from mrp.bom.flattened, and are otherwise
+        computed and stored (unless compute is False).
+        """
+        company_id = company_id or False
+        cache = self._get_kit_explosion_cache()
+        entries = {}
+        missing = self.browse()
+        for bom in self:
+            key = (bom.id, company_id)
+            if key in cache:
+                entries[bom.id] = cache[key]
             else:
-                # Old signature - reconstruct products from individual parameters
-                if product:
-                    return super()._bom_find([product], **{k: v for k, v in kwargs.items() if k not in ['product_tmpl', 'product']})
-                elif product_tmpl:
-                    # For product template, we need to find products
-                    products_for_tmpl = self.env['product.product'].search([('product_tmpl_id', '=', product_tmpl.id)])
-                    if products_for_tmpl:
-                        return super()._bom_find(products_for_tmpl, **{k: v for k, v in kwargs.items() if k not in ['product_tmpl', 'product']})
-                    else:
-                        return super()._bom_find([product_tmpl], **{k: v for k, v in kwargs.items() if k not in ['product_tmpl', 'product']})
+                missing |= bom
+        if not missing:
+            return entries
+        
+        Flattened = self.env['mrp.bom.flattened']
+        found = Flattened._get_entries(missing, company_id)
+        if compute:
+            to_compute = missing.filtered(lambda bom: bom.id not in found)
+            if to_compute:
+                computed = to_compute._compute_kit_flat(company_id)
+                Flattened._store_entries(computed, company_id)
+                found.update(computed)
+        for bom_id, entry in found.items():
+            cache[(bom_id, company_id)] = entries[bom_id] = entry
+        return entries
+
+    def _compute_kit_flat(self, company_id=False):
+        """
+        Compute the flattened explosion of these KIT BOMs.
+        The BOM graph is discovered one level at a time, with one _bom_find
+        call for all the components of a level; sub-KITs that already have
+        a memoized or stored explosion are not walked again. Explosions are
+        then composed bottom-up, so a sub-KIT shared by several parents is
+        expanded once and stored on its own.
+        Quantities are expressed in each product's base UoM, per base unit
+        of the kit, taking BOM line UoMs and BOM yields (product_qty) into
+        account.
+        BOM structures that contain themselves, or that nest deeper than
+        the sale_order_approval.kit_max_depth parameter, raise a UserError.
+        Returns a dict {bom_id: (components, bom_ids, product_ids)} for
+        these BOMs and every sub-KIT computed on the way.
+        """
+        Product = self.env['product.product']
+        # Sub-components always use their base BOM (they are never customized)
+        bom_model = self.with_context(flexible_bom_id=False, sale_line_id=False)
+        # bom_id -> (component product ids, ratios, sub-BOM id or False per component)
+        graph = {}
+        known = {}
+        max_depth = self._get_kit_max_depth()
+        frontier = self
+        depth = 0
+        while frontier:
+            if depth >= max_depth:
+                # Cycles end the discovery on their own (graph is keyed by BOM)
+                self._raise_kit_too_deep(self.browse(), max_depth)
+            ratios_by_bom = frontier._get_kit_line_ratios()
+            products = Product.browse({
+                product_id for product_ids, _ratios in ratios_by_bom.values() for product_id in product_ids
+            })
+            bom_by_product = bom_model._bom_find(products, company_id=company_id, bom_type='phantom')
+            KitTrace.debug("KIT level %s: %s BOMs, %s distinct components", depth, len(frontier), len(products))
+            sub_bom_id_by_product_id = {
+                product.id: bom.id for product, bom in bom_by_product.items() if bom and bom.type == 'phantom'
+            }
+            next_ids = set()
+            for bom_id, (product_ids, ratios) in ratios_by_bom.items():
+                sub_bom_ids = [sub_bom_id_by_product_id.get(product_id, False) for product_id in product_ids]
+                graph[bom_id] = (product_ids, ratios, sub_bom_ids)
+                next_ids.update(
+                    sub_bom_id for sub_bom_id in sub_bom_ids
+                    if sub_bom_id and sub_bom_id not in graph and sub_bom_id not in known
+                )
+            next_boms = self.browse(next_ids)
+            # Sub-KITs whose explosion is memoized or stored are reused as is
+            known.update(next_boms._get_kit_flat_entries(company_id, compute=False))
+            frontier = next_boms.filtered(lambda bom: bom.id not in known)
+            depth += 1
+        
+        computed = {}
+
+        def compose(bom_id):
+            product_ids, ratios, sub_bom_ids = graph[bom_id]
+            leaf_qtys = {}
+            dependency_bom_ids = {bom_id}
+            dependency_product_ids = set(product_ids)
+            for product_id, ratio, sub_bom_id in zip(product_ids, ratios, sub_bom_ids):
+                if sub_bom_id:
+                    sub_components, sub_bom_ids_, sub_product_ids = known.get(sub_bom_id) or computed[sub_bom_id]
+                    for component_id, qty in sub_components:
+                        leaf_qtys[component_id] = leaf_qtys.get(component_id, 0.0) + qty * ratio
+                    dependency_bom_ids |= sub_bom_ids_
+                    dependency_product_ids |= sub_product_ids
+                else:
+                    leaf_qtys[product_id] = leaf_qtys.get(product_id, 0.0) + ratio
+            computed[bom_id] = (
+                tuple(leaf_qtys.items()), frozenset(dependency_bom_ids), frozenset(dependency_product_ids),
+            )
+
+        def pending_sub_bom_ids(bom_id):
+            return iter({
+                sub_bom_id for sub_bom_id in graph[bom_id][2]
+                if sub_bom_id and sub_bom_id not in known and sub_bom_id not in computed
+            })
+
+        # Iterative post-order walk: a BOM is composed once all its sub-KITs are,
+        # and a sub-KIT already on the current path closes a cycle
+        for root_id in graph:
+            if root_id in computed:
+                continue
+            path = [root_id]
+            stack = [pending_sub_bom_ids(root_id)]
+            while stack:
+                sub_bom_id = next(stack[-1], None)
+                if sub_bom_id is None:
+                    stack.pop()
+                    compose(path.pop())
+                elif sub_bom_id in computed:
+                    # Reached through another branch of this walk (diamond)
+                    continue
+                elif sub_bom_id in path:
+                    self._raise_kit_cycle(path[path.index(sub_bom_id):] + [sub_bom_id])
                 else:
-                    # No products specified, return False
-                    return self.browse()
-        except TypeError:
-            # Fallback: try old method signature
-            return super()._bom_find(**kwargs)
+                    if len(path) >= max_depth:
+                        self._raise_kit_too_deep(path + [sub_bom_id], max_depth)
+                    path.append(sub_bom_id)
+                    stack.append(pending_sub_bom_ids(sub_bom_id))
+
+        KitTrace.debug("Exploded %s KIT BOMs over %s levels", len(computed), depth)
+        return computed
+
+    @api.model
+    def _get_kit_max_depth(self):
+        """Maximum number of nested KIT levels an explosion may walk"""
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            'sale_order_approval.kit_max_depth', DEFAULT_KIT_MAX_DEPTH
+        )) or DEFAULT_KIT_MAX_DEPTH
+
+    @api.model
+    def _raise_kit_cycle(self, bom_ids):
+        """Report a BOM path whose last BOM closes a cycle"""
+        raise UserError(
+            f"La lista de materiales KIT se contiene a sí misma: {self._get_kit_path_name(bom_ids)}."
+        )
+
+    @api.model
+    def _raise_kit_too_deep(self, bom_ids, max_depth):
+        path = f": {self._get_kit_path_name(bom_ids)}" if bom_ids else ""
+        raise UserError(
+            f"La estructura KIT supera la profundidad máxima de {max_depth} niveles{path}."
+        )
+
+    @api.model
+    def _get_kit_path_name(self, bom_ids):
+        name_by_id = {bom.id: bom.display_name for bom in self.browse(set(bom_ids)).sudo()}
+        return " → ".join(name_by_id[bom_id] for bom_id in bom_ids)
+
+    def _get_kit_line_ratios(self):
+        """
+        For each BOM, the quantity of every line's component (in its base
+        UoM) needed for one base unit of the BOM product, as a dict
+        {bom_id: (array of product ids, array of ratios)}.
+        UoM factors are read once for all BOMs and lines.
+        """
+        lines = self.bom_line_ids
+        uoms = self.product_uom_id | self.product_tmpl_id.uom_id | lines.product_uom_id | lines.product_id.uom_id
+        factors = {uom.id: uom.factor for uom in uoms}
+        ratios_by_bom = {}
+        for bom in self:
+            # BOM output, converted to the product's base UoM
+            output_qty = bom.product_qty / factors[bom.product_uom_id.id] * factors[bom.product_tmpl_id.uom_id.id]
+            product_ids, ratios = array('q'), array('d')
+            for line in bom.bom_line_ids:
+                line_qty = line.product_qty / factors[line.product_uom_id.id] * factors[line.product_id.uom_id.id]
+                product_ids.append(line.product_id.id)
+                ratios.append(line_qty / output_qty if output_qty else 0.0)
+            ratios_by_bom[bom.id] = (product_ids, ratios)
+        return ratios_by_bom
+
+
+class MrpBomLine(models.Model):
+    _inherit = 'mrp.bom.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['mrp.bom.flattened']._invalidate(lines.bom_id.ids)
+        return lines
+
+    def write(self, vals):
+        bom_ids = set(self.bom_id.ids)
+        res = super().write(vals)
+        self.env['mrp.bom.flattened']._invalidate(bom_ids | set(self.bom_id.ids))
+        return res
+
+    def unlink(self):
+        bom_ids = self.bom_id.ids
+        res = super().unlink()
+        self.env['mrp.bom.flattened']._invalidate(bom_ids)
+        return res
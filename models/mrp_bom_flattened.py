@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import logging
+
+from .mrp_bom import BOM_FIND_CACHE
+
+_logger = logging.getLogger(__name__)
+
+# Bumped whenever the meaning of stored components changes, so older rows are ignored
+# 2: quantities in base UoM per base unit of the kit, BOM yields applied
+# 3: revisions of the dependency BOMs recorded
+FLATTENED_VERSION = 3
+
+
+class MrpBomFlattened(models.Model):
+    """
+    Precomputed leaf components of a KIT BOM, for one unit of the kit.
+    Rows are built lazily by mrp.bom._explode_kit_flat and dropped whenever
+    a BOM or BOM line they depend on is written, unlinked or archived.
+    An edit cannot see the rows a concurrent transaction is storing, so it
+    also bumps the kit_revision of the edited BOMs: rows record the
+    revisions they were computed from and are ignored once these changed.
+    """
+    _name = 'mrp.bom.flattened'
+    _description = 'Flattened KIT BOM Components'
+
+    bom_id = fields.Many2one('mrp.bom', string='BOM', required=True, index=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Company', index=True, ondelete='cascade')
+    components = fields.Json(string='Leaf Components', help="List of [product_id, qty_per_unit] pairs")
+    component_count = fields.Integer(string='Component Count')
+    version = fields.Integer(default=FLATTENED_VERSION)
+    dependency_bom_ids = fields.Many2many(
+        'mrp.bom', 'mrp_bom_flattened_dependency_bom_rel', 'flattened_id', 'bom_id',
+        string='Sub-BOMs', help="Every BOM walked while flattening, including the BOM itself",
+    )
+    dependency_product_ids = fields.Many2many(
+        'product.product', 'mrp_bom_flattened_dependency_product_rel', 'flattened_id', 'product_id',
+        string='Looked-up Products', help="Products whose BOM was looked up while flattening",
+    )
+    dependency_revisions = fields.Json(
+        string='Sub-BOM Revisions', help="kit_revision of every dependency BOM when flattening, by BOM id",
+    )
+
+    @api.model
+    def _get_entries(self, boms, company_id=False):
+        """
+        Stored explosions of the given BOMs, as a dict {bom_id: (components,
+        bom_ids, product_ids)}; BOMs without a valid stored entry are left
+        out. Entries computed before one of their BOMs was edited (by a
+        concurrent transaction) are not valid.
+        """
+        entries = {}
+        stored = self.sudo().search([
+            ('bom_id', 'in', boms.ids),
+            ('company_id', '=', company_id or False),
+            ('version', '=', FLATTENED_VERSION),
+        ])
+        revisions = self._get_bom_revisions({
+            int(bom_id) for entry in stored for bom_id in entry.dependency_revisions or {}
+        })
+        for entry in stored:
+            dependency_revisions = entry.dependency_revisions or {}
+            if any(revisions.get(int(bom_id)) != revision for bom_id, revision in dependency_revisions.items()):
+                continue
+            entries.setdefault(entry.bom_id.id, (
+                tuple((product_id, qty) for product_id, qty in entry.components or []),
+                frozenset(int(bom_id) for bom_id in dependency_revisions),
+                frozenset(entry.dependency_product_ids.ids),
+            ))
+        return entries
+
+    @api.model
+    def _store_entries(self, entries, company_id=False):
+        """
+        Persist freshly computed explosions with the BOMs and products they
+        depend on, and the revisions of these BOMs as read by this
+        transaction. They replace the rows of the same BOMs left by an
+        older FLATTENED_VERSION or invalidated by a concurrent edit.
+        """
+        if not entries:
+            return self.browse()
+        self.sudo().search([
+            ('bom_id', 'in', list(entries)),
+            ('company_id', '=', company_id or False),
+        ]).unlink()
+        revisions = self._get_bom_revisions({bom_id for _components, bom_ids, _products in entries.values()
+                                             for bom_id in bom_ids})
+        return self.sudo().create([{
+            'bom_id': bom_id,
+            'company_id': company_id or False,
+            'components': [[product_id, qty] for product_id, qty in components],
+            'component_count': len(components),
+            'version': FLATTENED_VERSION,
+            'dependency_bom_ids': [fields.Command.set(list(bom_ids))],
+            'dependency_product_ids': [fields.Command.set(list(product_ids))],
+            'dependency_revisions': {str(dependency_id): revisions.get(dependency_id, 0) for dependency_id in bom_ids},
+        } for bom_id, (components, bom_ids, product_ids) in entries.items()])
+
+    @api.model
+    def _get_bom_revisions(self, bom_ids):
+        """Current kit_revision of the given BOMs, as a dict {bom_id: revision}; deleted BOMs are left out"""
+        if not bom_ids:
+            return {}
+        self.env.cr.execute("SELECT id, kit_revision FROM mrp_bom WHERE id = ANY(%s)", [list(bom_ids)])
+        return {bom_id: revision or 0 for bom_id, revision in self.env.cr.fetchall()}
+
+    @api.model
+    def _bump_bom_revisions(self, bom_ids, product_ids):
+        """
+        Bump the kit_revision of the given BOMs and of the BOMs using the
+        given products as components. The row update also serializes the
+        edit with concurrent edits of the same BOMs.
+        """
+        self.env['mrp.bom.line'].flush_model(['bom_id', 'product_id'])
+        self.env.cr.execute("""
+            UPDATE mrp_bom SET kit_revision = COALESCE(kit_revision, 0) + 1
+             WHERE id = ANY(%s)
+                OR id IN (SELECT bom_id FROM mrp_bom_line WHERE product_id = ANY(%s))
+        """, [list(bom_ids), list(product_ids)])
+        self.env['mrp.bom'].invalidate_model(['kit_revision'])
+
+    @api.model
+    def _invalidate(self, bom_ids=(), product_ids=()):
+        """
+        Drop every flattened entry that depends on the given BOMs or products.
+        Entries of untouched sub-KITs are kept, so only the edited subtree and
+        its ancestors are exploded again. The KIT previews of the affected
+        sale order lines are refreshed before commit.
+        """
+        bom_ids = set(bom_ids)
+        product_ids = set(product_ids)
+        self.env['mrp.bom']._get_kit_explosion_cache().clear()
+        self.env['mrp.bom']._get_transaction_cache(BOM_FIND_CACHE).clear()
+        if not bom_ids and not product_ids:
+            return
+        # Rows stored by transactions running concurrently are not visible
+        # here: they are rejected by _get_entries once the revisions moved
+        self._bump_bom_revisions(bom_ids, product_ids)
+        domain = [('id', '=', False)]
+        if bom_ids:
+            domain = ['|', '|'] + domain + [('bom_id', 'in', list(bom_ids)), ('dependency_bom_ids', 'in', list(bom_ids))]
+        if product_ids:
+            domain = ['|'] + domain + [('dependency_product_ids', 'in', list(product_ids))]
+        stale = self.sudo().search(domain)
+        if stale:
+            _logger.debug("Invalidating %s flattened KIT BOM entries", len(stale))
+            bom_ids.update(stale.bom_id.ids)
+            stale.unlink()
+        self.env['sale.order.line']._schedule_kit_preview_refresh(bom_ids, product_ids)
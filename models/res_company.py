@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    kit_trace_enabled = fields.Boolean(
+        string='Trace KIT Expansion',
+        help="Log one summary record per sale order line with the number of "
+             "KIT components and the time spent expanding them",
+    )
+    kit_snapshot_enabled = fields.Boolean(
+        string='Freeze KIT Components',
+        help="Store the exploded KIT components of each order line when the order leaves BOM "
+             "customization, and deliver from that snapshot instead of the current BOMs",
+    )
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+from .sale_order import CHATTER_POLICIES, DEFAULT_CHATTER_POLICY
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    kit_trace_enabled = fields.Boolean(related='company_id.kit_trace_enabled', readonly=False)
+    kit_snapshot_enabled = fields.Boolean(related='company_id.kit_snapshot_enabled', readonly=False)
+    sale_approval_chatter_policy = fields.Selection(
+        CHATTER_POLICIES,
+        string='Workflow Notifications',
+        default=DEFAULT_CHATTER_POLICY,
+        config_parameter='sale_order_approval.chatter_policy',
+    )
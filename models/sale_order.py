@@ -2,10 +2,26 @@
 
 from odoo import models, fields, api
 from odoo.exceptions import UserError
+from odoo.tools import float_compare
+from collections import defaultdict
+from markupsafe import Markup
 import logging
 
+from .kit_trace import record_phase
+from .sale_order_approval_pipeline import PIPELINE_STATES
+
 _logger = logging.getLogger(__name__)
 
+# Chatter notifications of workflow transitions (sale_order_approval.chatter_policy)
+CHATTER_POLICIES = [
+    ('full', 'Full'),
+    ('summary', 'Summary'),
+    ('off', 'Off'),
+]
+DEFAULT_CHATTER_POLICY = 'full'
+# Key of the workflow messages waiting to be logged in cr.precommit.data
+WORKFLOW_MESSAGES = 'sale_order_approval.workflow_messages'
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
@@ -17,104 +33,422 @@ class SaleOrder(models.Model):
         ],
         ondelete={'approved': 'cascade', 'bom_customization': 'cascade'}
     )
+    async_confirm_state = fields.Selection(
+        [
+            ('queued', 'En cola'),
+            ('running', 'Confirmando'),
+            ('failed', 'Error'),
+        ],
+        string='Confirmación en segundo plano',
+        copy=False,
+        index=True,
+        help="Progress of a background confirmation started from the BOM customization state",
+    )
+    confirm_job_ids = fields.One2many('sale.order.confirm.job', 'order_id', string='Confirmation Jobs', copy=False)
+    kit_component_count = fields.Integer(string='Componentes KIT', compute='_compute_kit_component_count')
 
-    def action_approve_order(self):
-        """Approve the sale order - transition to approved state"""
+    # Whether the state selection has the approval states, set by _register_hook
+    _approval_workflow_enabled = True
+
+    def _compute_kit_component_count(self):
+        counts = dict(self.env['sale.order.line.kit.component']._read_group(
+            [('order_id', 'in', self.ids)], ['order_id'], ['__count'],
+        ))
+        for order in self:
+            order.kit_component_count = counts.get(order, 0)
+
+    def write(self, vals):
+        leaving_customization = self.browse()
+        if 'state' in vals:
+            if vals['state'] in PIPELINE_STATES or any(order.state in PIPELINE_STATES for order in self):
+                self.env['sale.order.approval.pipeline']._schedule_refresh()
+            if vals['state'] != 'bom_customization':
+                leaving_customization = self.filtered(lambda order: order.state == 'bom_customization')
+        res = super().write(vals)
+        if leaving_customization:
+            leaving_customization._cancel_confirm_jobs()
+            if vals['state'] == 'sale':
+                # The stock rules of the confirmation still deliver from the KIT preview
+                leaving_customization.order_line._schedule_kit_preview_drop()
+            else:
+                leaving_customization.order_line._drop_kit_preview()
+        return res
+
+    def _cancel_confirm_jobs(self):
+        """Drop the pending background confirmation of orders that left BOM customization"""
+        self.confirm_job_ids.filtered(lambda job: job.state == 'pending').sudo().write({'state': 'cancel'})
+        self.filtered('async_confirm_state').write({'async_confirm_state': False})
+
+    def action_view_kit_components(self):
+        """Open the exploded KIT components of the order, loaded on demand"""
         self.ensure_one()
-        _logger.info(f"Approving order {self.name} - transition to 'approved' state")
-        
-        if self.state in ['draft', 'sent']:
-            self.state = 'approved'
-            
-            # Add a message to the chatter
-            self.message_post(
-                body="✅ La orden ha sido aprobada. Lista para customización de BOM.",
-                message_type='notification'
+        return {
+            'type': 'ir.actions.act_window',
+            'name': "Componentes KIT",
+            'res_model': 'sale.order.line.kit.component',
+            'view_mode': 'list',
+            'domain': [('order_id', '=', self.id)],
+            'context': {'group_by': 'line_id'},
+        }
+
+    def action_approve_order(self):
+        """Approve the sale orders - transition to approved state"""
+        invalid_orders = self.filtered(lambda order: order.state not in ['draft', 'sent'])
+        if invalid_orders:
+            raise UserError(
+                "Solo las cotizaciones en borrador o enviadas pueden ser aprobadas: %s"
+                % ", ".join(invalid_orders.mapped('name'))
             )
-            
-            return True
-        else:
-            raise UserError("Solo las cotizaciones en borrador o enviadas pueden ser aprobadas.")
+        _logger.info("Approving %s orders - transition to 'approved' state", len(self))
+        
+        self.write({'state': 'approved'})
+        
+        # Add a message to the chatter
+        self._log_workflow_message("✅ La orden ha sido aprobada. Lista para customización de BOM.")
+        return True
 
     def action_customize_bom(self):
-        """Move to BOM customization state"""
-        self.ensure_one()
-        _logger.info(f"Moving order {self.name} to BOM customization state")
+        """Move the sale orders to BOM customization state"""
+        invalid_orders = self.filtered(lambda order: order.state != 'approved')
+        if invalid_orders:
+            raise UserError(
+                "Solo las órdenes aprobadas pueden moverse a customización de BOM: %s"
+                % ", ".join(invalid_orders.mapped('name'))
+            )
+        _logger.info("Moving %s orders to BOM customization state", len(self))
         
-        if self.state == 'approved':
-            self.state = 'bom_customization'
-            
-            # Add a message to the chatter
-            self.message_post(
-                body="🔧 Orden movida a la fase de customización de BOM. Configure BOMs antes de la confirmación.",
-                message_type='notification'
+        self.write({'state': 'bom_customization'})
+        # Preview the exploded KIT components while BOMs are customized
+        self.order_line._refresh_kit_components()
+        
+        # Add a message to the chatter
+        self._log_workflow_message(
+            "🔧 Orden movida a la fase de customización de BOM. Configure BOMs antes de la confirmación."
+        )
+        return True
+
+    def action_confirm_async(self):
+        """
+        Queue the confirmation of orders in BOM customization, run outside
+        of the user's request by a cron-driven worker; a failure leaves the
+        order in 'bom_customization'.
+        """
+        invalid_orders = self.filtered(
+            lambda order: order.state != 'bom_customization' or order.async_confirm_state in ('queued', 'running')
+        )
+        if invalid_orders:
+            raise UserError(
+                "Solo las órdenes en customización de BOM pueden confirmarse en segundo plano: %s"
+                % ", ".join(invalid_orders.mapped('name'))
             )
-            
-            return True
+        self.env['sale.order.confirm.job']._enqueue(self)
+        self.write({'async_confirm_state': 'queued'})
+        self._log_workflow_message("⏳ La confirmación de la orden se procesará en segundo plano.")
+        return True
+
+    @api.model
+    def approve_orders_batch(self, order_ids):
+        """
+        JSON-RPC entry point approving many orders at once.
+        Returns one {'id', 'name', 'success', 'error'} dict per requested id.
+        """
+        return self._run_batch_transition(order_ids, ['draft', 'sent'], 'action_approve_order')
+
+    @api.model
+    def customize_bom_orders_batch(self, order_ids):
+        """
+        JSON-RPC entry point moving many approved orders to BOM customization.
+        Returns one {'id', 'name', 'success', 'error'} dict per requested id.
+        """
+        return self._run_batch_transition(order_ids, ['approved'], 'action_customize_bom')
+
+    @api.model
+    def _run_batch_transition(self, order_ids, allowed_states, method):
+        """Apply a workflow transition to the eligible orders and report per order"""
+        orders = self.browse(order_ids).exists()
+        eligible = orders.filtered(lambda order: order.state in allowed_states)
+        results = {order_id: {'id': order_id, 'name': False, 'success': False, 'error': "Orden no encontrada."}
+                   for order_id in order_ids}
+        for order in orders:
+            results[order.id].update(name=order.name, error="Estado no permitido: %s" % order.state)
+        if eligible:
+            getattr(eligible, method)()
+            for order in eligible:
+                results[order.id].update(success=True, error=False)
+        return [results[order_id] for order_id in order_ids]
+
+    def _log_workflow_message(self, body):
+        """
+        Queue the same workflow notification on every order. Queued messages
+        are logged in bulk right before commit, following the
+        sale_order_approval.chatter_policy parameter; automated callers can
+        skip them (and state tracking) with tracking_disable in the context.
+        """
+        if not self or self.env.context.get('tracking_disable') or self._get_chatter_policy() == 'off':
+            return
+        data = self.env.cr.precommit.data
+        if WORKFLOW_MESSAGES not in data:
+            data[WORKFLOW_MESSAGES] = {}
+            self.env.cr.precommit.add(self.browse()._flush_workflow_messages)
+        for order_id in self.ids:
+            data[WORKFLOW_MESSAGES].setdefault(order_id, []).append(body)
+
+    @api.model
+    def _get_chatter_policy(self):
+        policy = self.env['ir.config_parameter'].sudo().get_param(
+            'sale_order_approval.chatter_policy', DEFAULT_CHATTER_POLICY
+        )
+        return policy if policy in dict(CHATTER_POLICIES) else DEFAULT_CHATTER_POLICY
+
+    def _flush_workflow_messages(self):
+        """
+        Log the queued workflow messages with one mail.message create per
+        distinct body: every message in 'full' mode, a single message per
+        order gathering the transaction's notifications in 'summary' mode.
+        """
+        bodies_by_order_id = self.env.cr.precommit.data.pop(WORKFLOW_MESSAGES, {})
+        order_ids_by_body = defaultdict(list)
+        if self._get_chatter_policy() == 'summary':
+            for order_id, bodies in bodies_by_order_id.items():
+                order_ids_by_body[Markup('<br/>').join(bodies)].append(order_id)
         else:
-            raise UserError("Solo las órdenes aprobadas pueden moverse a customización de BOM.")
+            for order_id, bodies in bodies_by_order_id.items():
+                for body in bodies:
+                    order_ids_by_body[body].append(order_id)
+        for body, order_ids in order_ids_by_body.items():
+            orders = self.browse(order_ids).exists()
+            if orders:
+                orders._message_log_batch(bodies=dict.fromkeys(orders.ids, body))
+        self.env.flush_all()
+
+    def _register_hook(self):
+        super()._register_hook()
+        # The complete state selection is only known once every module is loaded
+        states = dict(self._fields['state'].selection)
+        type(self)._approval_workflow_enabled = 'approved' in states and 'bom_customization' in states
+
+    def _confirmation_error_message(self):
+        """Accept orders in BOM customization, with the same checks as a quotation"""
+        self.ensure_one()
+        if self.state != 'bom_customization':
+            return super()._confirmation_error_message()
+        if any(not line.display_type and not line.is_downpayment and not line.product_id for line in self.order_line):
+            return "Una línea de estas órdenes no tiene producto, no se puede confirmar."
+        return False
 
     def action_confirm(self):
-        """Override confirm to require approval and BOM customization"""
-        # Check if this order has our custom states
-        state_selection = dict(self._fields['state'].selection)
-        has_approval_states = 'approved' in state_selection and 'bom_customization' in state_selection
+        """
+        Override confirm to require approval and BOM customization. Orders in
+        BOM customization are confirmed together by the standard method, so a
+        batch gets a single state write.
+        """
+        if not self._approval_workflow_enabled:
+            return super().action_confirm()
+        orders_by_state = self.grouped('state')
+        approved = orders_by_state.get('approved')
+        if approved:
+            raise UserError(
+                "Esta orden está aprobada pero debe pasar por la fase de 'Customizar BOM' "
+                "antes de ser confirmada. Por favor, haga clic en el botón 'Customize BOM' primero: %s"
+                % ", ".join(approved.mapped('name'))
+            )
+        quotations = orders_by_state.get('draft', self.browse()) | orders_by_state.get('sent', self.browse())
+        if quotations:
+            raise UserError(
+                "Esta orden debe ser aprobada y pasar por customización de BOM antes de ser confirmada. "
+                "Por favor, use el botón 'Approve Order' primero: %s"
+                % ", ".join(quotations.mapped('name'))
+            )
+        customizing = orders_by_state.get('bom_customization')
+        if not customizing:
+            return super().action_confirm()
+        
+        with record_phase(self.env, 'action_confirm', self):
+            # Freeze the exploded KITs the stock rules are about to deliver
+            customizing.order_line._store_kit_snapshot()
+            result = super().action_confirm()
+        
+        # Messages are only queued once the confirmation went through
+        customizing._log_workflow_message(
+            "🚚 La orden está siendo confirmada. Creando entregas y órdenes de manufactura..."
+        )
+        customizing._log_workflow_message("✅ ¡Orden confirmada exitosamente!")
+        return result
+
+    def action_confirm_batch(self):
+        """
+        Confirm many orders at once in the background, spread over the
+        worker crons. Each order is confirmed in its own transaction, so one
+        failure does not roll back the others.
+        """
+        results = self.confirm_orders_batch(self.ids)
+        failed = [result for result in results if not result['success']]
+        message = "%s órdenes en cola de confirmación, %s con errores." % (len(results) - len(failed), len(failed))
+        if failed:
+            message += "\n" + "\n".join(f"{result['name']}: {result['error']}" for result in failed)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': "Confirmación masiva",
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    @api.model
+    def confirm_orders_batch(self, order_ids):
+        """
+        JSON-RPC entry point confirming many orders in BOM customization.
+        Every order gets a background confirmation job; up to
+        sale_order_approval.confirm_workers worker crons run them in
+        parallel, each order in its own transaction. The outcome of each
+        order is then found in its async_confirm_state and chatter.
+        Returns one {'id', 'name', 'success', 'error'} dict per requested
+        id, success meaning the order was queued.
+        """
+        orders = self.browse(order_ids).exists()
+        results = {order_id: {'id': order_id, 'name': False, 'success': False, 'error': "Orden no encontrada."}
+                   for order_id in order_ids}
+        for order in orders:
+            if order.state != 'bom_customization':
+                error = "Estado no permitido: %s" % order.state
+            elif order.async_confirm_state in ('queued', 'running'):
+                error = "La orden ya está en cola de confirmación."
+            else:
+                error = False
+            results[order.id].update(name=order.name, success=not error, error=error)
+        eligible = orders.filtered(lambda order: results[order.id]['success'])
+        if eligible:
+            eligible.action_confirm_async()
+        return [results[order_id] for order_id in order_ids]
+
+    def action_check_kit_availability(self):
+        """Explode the KIT lines of the orders and show the component shortages"""
+        shortages = self._get_kit_shortages()
+        wizard = self.env['sale.order.kit.availability'].create({
+            'order_ids': [fields.Command.set(self.ids)],
+            'shortage_order_count': len({shortage['order_id'] for shortage in shortages}),
+            'line_ids': [fields.Command.create(shortage) for shortage in shortages],
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'name': "Disponibilidad de componentes KIT",
+            'res_model': 'sale.order.kit.availability',
+            'res_id': wizard.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _get_kit_shortages(self):
+        """
+        Check the stock of the leaf components the orders will deliver.
+        Demand is summed per order, warehouse and product, stock is read with
+        a single grouped stock.quant query, and free stock is allocated to
+        the oldest orders first.
+        Returns a list of dicts with order_id, warehouse_id, product_id,
+        demand_qty, available_qty and shortage_qty, one per missing component.
+        """
+        lines = self.order_line.filtered(lambda line: line.product_id and not line.display_type)
+        components_by_line = lines._get_kit_components_by_line()
+        demand = defaultdict(float)
+        for line in lines:
+            components = components_by_line.get(line) or [(line.product_id, line._get_kit_base_qty())]
+            for product, qty in components:
+                if product.is_storable:
+                    demand[(line.order_id, line.order_id.warehouse_id, product)] += qty
+        if not demand:
+            return []
         
-        if has_approval_states:
-            # Only apply our workflow rules if the order has our custom states
-            if self.state == 'bom_customization':
-                # Add a message before confirming
-                self.message_post(
-                    body="🚚 La orden está siendo confirmada. Creando entregas y órdenes de manufactura...",
-                    message_type='notification'
-                )
-                
-                # Temporarily change state to 'sent' so Odoo can confirm it
-                original_state = self.state
-                self.state = 'sent'
-                
-                try:
-                    # Call the original confirm method
-                    result = super().action_confirm()
-                    
-                    # Add success message
-                    self.message_post(
-                        body="✅ ¡Orden confirmada exitosamente!",
-                        message_type='notification'
-                    )
-                    
-                    return result
-                except Exception as e:
-                    # If confirmation fails, restore the original state
-                    self.state = original_state
-                    raise e
-                
-            elif self.state == 'approved':
-                raise UserError(
-                    "Esta orden está aprobada pero debe pasar por la fase de 'Customizar BOM' "
-                    "antes de ser confirmada. Por favor, haga clic en el botón 'Customize BOM' primero."
-                )
-            elif self.state in ['draft', 'sent']:
-                raise UserError(
-                    "Esta orden debe ser aprobada y pasar por customización de BOM antes de ser confirmada. "
-                    "Por favor, use el botón 'Approve Order' primero."
-                )
+        products = self.env['product.product'].union(*(product for _order, _warehouse, product in demand))
+        warehouses = self.env['stock.warehouse'].union(*(warehouse for _order, warehouse, _product in demand))
+        free_qty = defaultdict(float)
+        for product, location, quantity, reserved_quantity in self.env['stock.quant']._read_group(
+            [('product_id', 'in', products.ids), ('location_id', 'child_of', warehouses.lot_stock_id.ids)],
+            ['product_id', 'location_id'],
+            ['quantity:sum', 'reserved_quantity:sum'],
+        ):
+            free_qty[(location.warehouse_id, product)] += quantity - reserved_quantity
         
-        # For orders without approval workflow or in standard states, use standard behavior
-        return super().action_confirm()
+        shortages = []
+        for key in sorted(demand, key=lambda key: (key[0].date_order, key[0].id, key[2].id)):
+            order, warehouse, product = key
+            qty = demand[key]
+            available = max(free_qty[(warehouse, product)], 0.0)
+            allocated = min(qty, available)
+            free_qty[(warehouse, product)] = available - allocated
+            if float_compare(qty, allocated, precision_rounding=product.uom_id.rounding) > 0:
+                shortages.append({
+                    'order_id': order.id,
+                    'warehouse_id': warehouse.id,
+                    'product_id': product.id,
+                    'demand_qty': qty,
+                    'available_qty': available,
+                    'shortage_qty': qty - allocated,
+                })
+        return shortages
+
+    def _get_flexible_bom_by_product(self, products=None):
+        """
+        Resolve the BOM to use for each product of the order in one pass:
+        a flexible BOM set on a line of this order, else the most recent
+        flexible BOM of the product, else its base KIT BOM.
+        Returns a dict {product.product: mrp.bom}; products without any
+        BOM are left out.
+        """
+        self.ensure_one()
+        if products is None:
+            products = self.order_line.product_id
+        Bom = self.env['mrp.bom']
+        bom_by_product = {}
+        
+        # Flexible BOMs linked to sale order lines in this order (served by the
+        # partial index on has_flexible_bom; flexible_bom_id is checked too in
+        # case the BOM was deleted behind the ORM's back)
+        if 'flexible_bom_id' in self.order_line._fields:
+            for line in self.env['sale.order.line'].search([
+                ('order_id', '=', self.id),
+                ('product_id', 'in', products.ids),
+                ('has_flexible_bom', '=', True),
+                ('flexible_bom_id', '!=', False),
+            ]):
+                bom_by_product.setdefault(line.product_id, line.flexible_bom_id)
+        
+        # Most recent flexible BOM of each remaining product: one aggregate
+        # row per product (ids grow with creation), served by the partial index
+        remaining = products.filtered(lambda p: p not in bom_by_product)
+        if remaining and 'is_flexible_bom' in Bom._fields:
+            for product, bom_id in Bom._read_group([
+                ('product_id', 'in', remaining.ids),
+                ('is_flexible_bom', '=', True)
+            ], ['product_id'], ['id:max']):
+                bom_by_product[product] = Bom.browse(bom_id)
+        
+        # Base KIT BOM of everything else, in one _bom_find call
+        remaining = remaining.filtered(lambda p: p not in bom_by_product)
+        if remaining:
+            base_boms = Bom._bom_find(
+                remaining,
+                company_id=self.company_id.id,
+                bom_type='phantom'  # Only look for KIT BOMs
+            )
+            for product in remaining:
+                if base_boms.get(product):
+                    bom_by_product[product] = base_boms[product]
+        
+        _logger.debug("Resolved BOMs for %s of %s products in order %s", len(bom_by_product), len(products), self.id)
+        return bom_by_product
 
     def action_cancel(self):
         """Override cancel to handle approved and BOM customization states"""
-        if self.state == 'approved':
-            self.message_post(
-                body="❌ Orden aprobada ha sido cancelada.",
-                message_type='notification'
-            )
-        elif self.state == 'bom_customization':
-            self.message_post(
-                body="❌ Orden en customización de BOM ha sido cancelada.",
-                message_type='notification'
-            )
+        self.filtered(lambda order: order.state == 'approved')._log_workflow_message(
+            "❌ Orden aprobada ha sido cancelada."
+        )
+        self.filtered(lambda order: order.state == 'bom_customization')._log_workflow_message(
+            "❌ Orden en customización de BOM ha sido cancelada."
+        )
         return super().action_cancel()
 
     @api.model
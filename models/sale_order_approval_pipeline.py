@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.tools.sql import TableKind, table_kind
+from datetime import timedelta
+
+# Sale order states shown in the approval pipeline
+PIPELINE_STATES = ('approved', 'bom_customization')
+# Seconds to wait before refreshing after a state transition, so a burst of
+# transitions is folded into one refresh
+PIPELINE_REFRESH_DELAY = 60
+# Key of the pending pipeline refresh in cr.precommit.data
+PIPELINE_REFRESH = 'sale_order_approval.pipeline_refresh'
+
+
+class SaleOrderApprovalPipeline(models.Model):
+    """
+    Orders waiting in the approval pipeline, per state, company and
+    currency. Backed by a materialized view refreshed by cron and shortly
+    after state transitions, so it loads without scanning sale_order.
+    """
+    _name = 'sale.order.approval.pipeline'
+    _description = 'Sale Order Approval Pipeline'
+    _auto = False
+    _order = 'state, company_id'
+
+    state = fields.Selection(
+        [
+            ('approved', 'Aprobada'),
+            ('bom_customization', 'Customizar BOM'),
+        ],
+        readonly=True,
+    )
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    order_count = fields.Integer(string='Orders', readonly=True)
+    amount_untaxed = fields.Monetary(string='Untaxed Amount', readonly=True)
+    amount_total = fields.Monetary(string='Total', readonly=True)
+    oldest_date_order = fields.Datetime(string='Oldest Order Date', readonly=True)
+    avg_age_days = fields.Float(string='Avg. Age (days)', digits=(16, 1), readonly=True)
+    max_age_days = fields.Float(string='Max. Age (days)', digits=(16, 1), readonly=True)
+    # KIT components are only exploded (previewed) once orders reach BOM customization
+    kit_line_count = fields.Integer(
+        string='KIT Lines', readonly=True, help="KIT lines of the orders in BOM customization",
+    )
+    component_count = fields.Integer(
+        string='KIT Components', readonly=True, help="Exploded KIT components of the orders in BOM customization",
+    )
+    refresh_date = fields.Datetime(string='Refreshed On', readonly=True)
+
+    def init(self):
+        cr = self.env.cr
+        kind = table_kind(cr, self._table)
+        if kind == TableKind.Materialized:
+            cr.execute(f"DROP MATERIALIZED VIEW {self._table} CASCADE")
+        elif kind == TableKind.View:
+            cr.execute(f"DROP VIEW {self._table} CASCADE")
+        cr.execute(f"""
+            CREATE MATERIALIZED VIEW {self._table} AS (
+                SELECT
+                    row_number() OVER (ORDER BY so.state, so.company_id, so.currency_id) AS id,
+                    so.state,
+                    so.company_id,
+                    so.currency_id,
+                    count(*) AS order_count,
+                    sum(so.amount_untaxed) AS amount_untaxed,
+                    sum(so.amount_total) AS amount_total,
+                    min(so.date_order) AS oldest_date_order,
+                    avg(extract(epoch FROM (now() AT TIME ZONE 'UTC') - so.date_order)) / 86400 AS avg_age_days,
+                    max(extract(epoch FROM (now() AT TIME ZONE 'UTC') - so.date_order)) / 86400 AS max_age_days,
+                    CASE WHEN so.state = 'bom_customization'
+                         THEN coalesce(sum(kit.line_count), 0) END AS kit_line_count,
+                    CASE WHEN so.state = 'bom_customization'
+                         THEN coalesce(sum(kit.component_count), 0) END AS component_count,
+                    now() AT TIME ZONE 'UTC' AS refresh_date
+                FROM sale_order so
+                LEFT JOIN (
+                    SELECT order_id, count(DISTINCT line_id) AS line_count, count(*) AS component_count
+                    FROM sale_order_line_kit_component
+                    GROUP BY order_id
+                ) kit ON kit.order_id = so.id
+                WHERE so.state IN %s
+                GROUP BY so.state, so.company_id, so.currency_id
+            )
+        """, [PIPELINE_STATES])
+        # Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+        cr.execute(f"CREATE UNIQUE INDEX {self._table}_id_index ON {self._table} (id)")
+
+    @api.model
+    def _refresh(self):
+        """Recompute the pipeline without blocking readers"""
+        self.env.flush_all()
+        self.env.cr.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self._table}")
+        self.invalidate_model()
+
+    @api.model
+    def _cron_refresh(self):
+        self._refresh()
+
+    @api.model
+    def _schedule_refresh(self):
+        """Have the cron refresh the pipeline shortly after this transaction"""
+        data = self.env.cr.precommit.data
+        if PIPELINE_REFRESH in data:
+            return
+        data[PIPELINE_REFRESH] = True
+        cron = self.env.ref('sale_order_approval.ir_cron_refresh_approval_pipeline', raise_if_not_found=False)
+        if cron:
+            cron._trigger(fields.Datetime.now() + timedelta(seconds=PIPELINE_REFRESH_DELAY))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from psycopg2 import errors as pg_errors
+import logging
+import random
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Errors worth retrying when concurrent workers confirm orders
+PG_CONCURRENCY_ERRORS = (
+    pg_errors.SerializationFailure,
+    pg_errors.DeadlockDetected,
+    pg_errors.LockNotAvailable,
+)
+CONFIRM_MAX_TRIES = 5
+# Crons running the jobs; sale_order_approval.confirm_workers of them are woken up
+WORKER_CRONS = [
+    'sale_order_approval.ir_cron_process_confirm_jobs',
+    'sale_order_approval.ir_cron_process_confirm_jobs_2',
+    'sale_order_approval.ir_cron_process_confirm_jobs_3',
+    'sale_order_approval.ir_cron_process_confirm_jobs_4',
+]
+DEFAULT_CONFIRM_WORKERS = 4
+
+
+class SaleOrderConfirmJob(models.Model):
+    """
+    Background confirmation of one order in BOM customization, run by
+    cron-driven workers; several worker crons share the pending jobs. The
+    whole of action_confirm (KIT explosion, pickings, moves, reservations,
+    MOs) runs in the job's transaction and is not split, so a failure
+    never leaves an order half delivered.
+    Pending jobs are cancelled when the order leaves BOM customization
+    another way.
+    """
+    _name = 'sale.order.confirm.job'
+    _description = 'Sale Order Background Confirmation Job'
+    _order = 'id'
+
+    order_id = fields.Many2one('sale.order', string='Order', required=True, index=True, ondelete='cascade')
+    state = fields.Selection(
+        [
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+            ('cancel', 'Cancelled'),
+        ],
+        default='pending',
+        required=True,
+        index=True,
+    )
+    error = fields.Text()
+    attempt_count = fields.Integer(string='Attempts', default=0)
+
+    @api.model
+    def _enqueue(self, orders):
+        """Create the confirmation job of the given orders and wake up the worker"""
+        # Drop the jobs of a previous, failed attempt
+        orders.confirm_job_ids.sudo().unlink()
+        jobs = self.sudo().create([{'order_id': order.id} for order in orders])
+        self._trigger_worker(len(jobs))
+        return jobs
+
+    @api.model
+    def _trigger_worker(self, job_count=1):
+        """Wake up one worker cron per job, up to sale_order_approval.confirm_workers"""
+        workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'sale_order_approval.confirm_workers', DEFAULT_CONFIRM_WORKERS
+        ))
+        for xmlid in WORKER_CRONS[:max(1, min(workers, job_count))]:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+    @api.model
+    def _claim_job(self):
+        """
+        Lock the oldest pending job no other worker is running, if any.
+        Returns an empty recordset when there is none.
+        """
+        self.flush_model(['state'])
+        self.env.cr.execute(f"""
+            SELECT id FROM {self._table}
+             WHERE state = 'pending'
+             ORDER BY id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """)
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_process_jobs(self, limit=100):
+        """
+        Claim and run pending jobs one at a time, committing after each one,
+        so every order is confirmed in its own transaction. Jobs hitting a
+        concurrency error are retried on a fresh transaction, up to
+        CONFIRM_MAX_TRIES attempts.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _index in range(limit):
+            try:
+                job = self._claim_job()
+            except pg_errors.SerializationFailure:
+                # Run and committed by another worker since this snapshot was taken
+                self.env.cr.rollback()
+                continue
+            if not job:
+                break
+            retry_delay = 0.0
+            try:
+                with self.env.cr.savepoint():
+                    job._run()
+            except PG_CONCURRENCY_ERRORS as e:
+                job.attempt_count += 1
+                if job.attempt_count >= CONFIRM_MAX_TRIES:
+                    job._fail(str(e))
+                else:
+                    _logger.info(
+                        "Concurrency error confirming %s, retrying (%s/%s)",
+                        job.order_id.name, job.attempt_count, CONFIRM_MAX_TRIES,
+                    )
+                    retry_delay = random.uniform(0.0, 0.1 * 2 ** job.attempt_count)
+            except Exception as e:
+                _logger.exception("Background confirmation of %s failed", job.order_id.name)
+                job._fail(str(e))
+            if auto_commit:
+                self.env.cr.commit()
+                if retry_delay:
+                    time.sleep(retry_delay)
+        pending_count = self.search_count([('state', '=', 'pending')])
+        if pending_count:
+            self._trigger_worker(pending_count)
+
+    def _run(self):
+        self.ensure_one()
+        order = self.order_id
+        if order.state != 'bom_customization':
+            raise UserError(f"La orden {order.name} ya no está en customización de BOM.")
+        order.async_confirm_state = 'running'
+        order.action_confirm()
+        order.async_confirm_state = False
+        self.state = 'done'
+
+    def _fail(self, error):
+        """Mark the job failed; the order stays in BOM customization"""
+        self.ensure_one()
+        order = self.order_id
+        self.write({
+            'state': 'failed',
+            'error': error,
+        })
+        order.async_confirm_state = 'failed'
+        order._log_workflow_message(f"❌ La confirmación en segundo plano falló: {error}")
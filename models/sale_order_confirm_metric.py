@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+
+# Phases of the approval/confirmation workflow that are measured
+CONFIRM_PHASES = [
+    ('action_confirm', 'Confirm Order'),
+    ('launch_stock_rule', 'Launch Stock Rules'),
+    ('kit_explosion', 'KIT Explosion'),
+    ('create_kit_moves', 'Create KIT Moves'),
+    ('picking_confirm', 'Confirm Pickings'),
+]
+DEFAULT_RETENTION_DAYS = 30
+
+
+class SaleOrderConfirmMetric(models.Model):
+    """
+    One timing sample of a confirmation phase, flushed from the in-memory
+    ring buffer of kit_trace.record_phase.
+    """
+    _name = 'sale.order.confirm.metric'
+    _description = 'Sale Order Confirmation Metric'
+    _order = 'create_date desc, id desc'
+
+    phase = fields.Selection(CONFIRM_PHASES, required=True, index=True)
+    order_id = fields.Many2one('sale.order', string='Order', index=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Company', index=True, ondelete='cascade')
+    duration_ms = fields.Float(string='Duration (ms)', digits=(16, 2))
+    query_count = fields.Integer(string='SQL Queries')
+    component_count = fields.Integer(string='Components')
+
+    @api.model
+    def _create_from_samples(self, samples):
+        # Orders may have been deleted since the sample was taken
+        order_ids = {sample['order_id'] for sample in samples if sample['order_id']}
+        existing_ids = set(self.env['sale.order'].browse(order_ids).exists().ids)
+        for sample in samples:
+            if sample['order_id'] not in existing_ids:
+                sample['order_id'] = False
+        return self.create(samples)
+
+    @api.autovacuum
+    def _gc_old_metrics(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param(
+            'sale_order_approval.metrics_retention_days', DEFAULT_RETENTION_DAYS
+        ))
+        self.search([('create_date', '<', fields.Datetime.subtract(fields.Datetime.now(), days=days))]).unlink()
+
+
+class SaleOrderConfirmMetricReport(models.Model):
+    """p50/p95 duration per confirmation phase"""
+    _name = 'sale.order.confirm.metric.report'
+    _description = 'Sale Order Confirmation Phase Statistics'
+    _auto = False
+    _order = 'p95_ms desc'
+
+    phase = fields.Selection(CONFIRM_PHASES, readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    sample_count = fields.Integer(string='Samples', readonly=True)
+    p50_ms = fields.Float(string='p50 (ms)', digits=(16, 2), readonly=True)
+    p95_ms = fields.Float(string='p95 (ms)', digits=(16, 2), readonly=True)
+    max_ms = fields.Float(string='Max (ms)', digits=(16, 2), readonly=True)
+    avg_query_count = fields.Float(string='Avg. SQL Queries', digits=(16, 1), readonly=True)
+    avg_component_count = fields.Float(string='Avg. Components', digits=(16, 1), readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT
+                    min(m.id) AS id,
+                    m.phase,
+                    m.company_id,
+                    count(*) AS sample_count,
+                    percentile_cont(0.5) WITHIN GROUP (ORDER BY m.duration_ms) AS p50_ms,
+                    percentile_cont(0.95) WITHIN GROUP (ORDER BY m.duration_ms) AS p95_ms,
+                    max(m.duration_ms) AS max_ms,
+                    avg(m.query_count) AS avg_query_count,
+                    avg(m.component_count) AS avg_component_count
+                FROM sale_order_confirm_metric m
+                GROUP BY m.phase, m.company_id
+            )
+        """)
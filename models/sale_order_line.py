@@ -1,21 +1,165 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from odoo.tools import float_compare
+from odoo.tools.sql import create_index
+from collections import defaultdict
 import logging
 
+from .kit_trace import KitTrace, record_phase
+from .mrp_bom import BOM_FIND_CACHE
+
 _logger = logging.getLogger(__name__)
 
+# sale.order.line fields the KIT component preview depends on
+KIT_PREVIEW_FIELDS = {'flexible_bom_id', 'product_id', 'product_uom_qty', 'product_uom'}
+# sale.order.line fields that make a KIT snapshot obsolete
+KIT_SNAPSHOT_FIELDS = {'flexible_bom_id', 'product_id'}
+# Key of the pending KIT preview refreshes in cr.precommit.data
+KIT_PREVIEW_REFRESH = 'sale_order_approval.kit_preview_refresh'
+# Key of the KIT previews to drop before commit in cr.precommit.data
+KIT_PREVIEW_DROP = 'sale_order_approval.kit_preview_drop'
+
 
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
 
+    kit_component_ids = fields.One2many('sale.order.line.kit.component', 'line_id', string='KIT Components', copy=False)
+    kit_preview_bom_id = fields.Many2one('mrp.bom', string='Previewed KIT BOM', index=True, copy=False, ondelete='set null')
+    kit_preview_qty = fields.Float(string='Previewed Quantity', digits='Product Unit of Measure', copy=False)
+    # Denormalized "flexible_bom_id is set", so flexible BOM lookups can use
+    # a small partial index
+    has_flexible_bom = fields.Boolean(
+        string='Has Flexible BOM', compute='_compute_has_flexible_bom', store=True, copy=False,
+    )
+    kit_snapshot = fields.Json(
+        string='KIT Snapshot', copy=False, readonly=True,
+        help="KIT BOM and leaf components per base unit of the line, frozen when the order left "
+             "BOM customization: {'bom_id': id, 'components': [[product_id, qty], ...]}",
+    )
+
+    def init(self):
+        super().init()
+        create_index(
+            self.env.cr, 'sale_order_line_flexible_bom_order_product_index', self._table,
+            ['order_id', 'product_id'], where='has_flexible_bom',
+        )
+
+    @api.depends(lambda self: ['flexible_bom_id'] if 'flexible_bom_id' in self._fields else [])
+    def _compute_has_flexible_bom(self):
+        has_field = 'flexible_bom_id' in self._fields
+        for line in self:
+            line.has_flexible_bom = has_field and bool(line.flexible_bom_id)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._refresh_kit_components()
+        return lines
+
+    def write(self, vals):
+        if KIT_SNAPSHOT_FIELDS.intersection(vals) and 'kit_snapshot' not in vals:
+            vals = dict(vals, kit_snapshot=False)
+        res = super().write(vals)
+        if 'flexible_bom_id' in vals:
+            # Flexible BOM lookups of mrp.bom._bom_find are cached per sale line
+            self.env['mrp.bom']._get_transaction_cache(BOM_FIND_CACHE).clear()
+        if KIT_PREVIEW_FIELDS.intersection(vals):
+            self._refresh_kit_components()
+        return res
+
+    def _refresh_kit_components(self):
+        """
+        Rebuild the KIT component preview of the lines whose order is in
+        BOM customization. Unchanged sub-KITs come from their stored
+        explosion, so only edited subtrees are walked again.
+        """
+        lines = self.filtered(lambda line: line.order_id.state == 'bom_customization' and line.product_id)
+        if not lines:
+            return
+        bom_by_line = lines._get_kit_bom_by_line()
+        lines.kit_component_ids.unlink()
+        component_vals = []
+        for line in lines:
+            bom = bom_by_line.get(line)
+            if bom and bom.type == 'phantom':
+                qty = line._get_kit_base_qty()
+                component_vals.extend({
+                    'line_id': line.id,
+                    'product_id': product.id,
+                    'product_uom_qty': component_qty,
+                } for product, component_qty in line._get_all_kit_components(line.product_id, bom, qty))
+                line.write({'kit_preview_bom_id': bom.id, 'kit_preview_qty': qty})
+            elif line.kit_preview_bom_id:
+                line.write({'kit_preview_bom_id': False, 'kit_preview_qty': 0.0})
+        self.env['sale.order.line.kit.component'].create(component_vals)
+
+    @api.model
+    def _schedule_kit_preview_refresh(self, bom_ids, product_ids):
+        """
+        Drop the KIT previews built from the given BOMs, or for the given
+        products, and rebuild them before commit.
+        """
+        if not bom_ids and not product_ids:
+            return
+        # Previews only exist while the order is in BOM customization
+        lines = self.sudo().search([
+            ('order_id.state', '=', 'bom_customization'),
+            '|', ('kit_preview_bom_id', 'in', list(bom_ids)), ('product_id', 'in', list(product_ids)),
+        ])
+        if not lines:
+            return
+        lines._drop_kit_preview()
+        data = self.env.cr.precommit.data
+        if KIT_PREVIEW_REFRESH not in data:
+            data[KIT_PREVIEW_REFRESH] = set()
+            self.env.cr.precommit.add(self.sudo()._flush_kit_preview_refresh)
+        data[KIT_PREVIEW_REFRESH].update(lines.ids)
+
+    def _drop_kit_preview(self):
+        """Remove the KIT preview of the lines, e.g. once their order left BOM customization"""
+        self.kit_component_ids.unlink()
+        self.filtered('kit_preview_bom_id').write({'kit_preview_bom_id': False, 'kit_preview_qty': 0.0})
+
+    def _schedule_kit_preview_drop(self):
+        """
+        Drop the KIT preview of the lines before commit, so the stock rules
+        launched in this transaction can still deliver from it.
+        """
+        if not self:
+            return
+        data = self.env.cr.precommit.data
+        if KIT_PREVIEW_DROP not in data:
+            data[KIT_PREVIEW_DROP] = set()
+            self.env.cr.precommit.add(self.sudo()._flush_kit_preview_drop)
+        data[KIT_PREVIEW_DROP].update(self.ids)
+
+    def _flush_kit_preview_drop(self):
+        line_ids = self.env.cr.precommit.data.pop(KIT_PREVIEW_DROP, set())
+        lines = self.browse(line_ids).exists()
+        lines.filtered(lambda line: line.order_id.state != 'bom_customization')._drop_kit_preview()
+        self.env.flush_all()
+
+    def _flush_kit_preview_refresh(self):
+        line_ids = self.env.cr.precommit.data.pop(KIT_PREVIEW_REFRESH, set())
+        self.browse(line_ids).exists()._refresh_kit_components()
+        self.env.flush_all()
+
+    def _get_kit_preview_components(self, bom, qty):
+        """Components of the up-to-date KIT preview of the line, or None"""
+        self.ensure_one()
+        if self.kit_preview_bom_id != bom or not self.kit_component_ids or \
+           float_compare(self.kit_preview_qty, qty, precision_rounding=self.product_id.uom_id.rounding) != 0:
+            return None
+        return [(component.product_id, component.product_uom_qty) for component in self.kit_component_ids]
+
     def _prepare_procurement_values(self, group_id=False):
         """Override to inject flexible BOM into procurement"""
         values = super()._prepare_procurement_values(group_id)
         
         # If this line has a flexible BOM, inject it into the procurement context
         if hasattr(self, 'flexible_bom_id') and self.flexible_bom_id:
-            _logger.info(f"🔧 Injecting flexible BOM {self.flexible_bom_id.display_name} into procurement for line {self.id}")
+            _logger.debug("Injecting flexible BOM %s into procurement for line %s", self.flexible_bom_id.id, self.id)
             values['flexible_bom_id'] = self.flexible_bom_id.id
             # Override the standard BOM search
             values['bom_id'] = self.flexible_bom_id.id
@@ -26,197 +170,257 @@ class SaleOrderLine(models.Model):
         """
         Find flexible BOM for a product in the current sale order.
         If no flexible BOM exists, fallback to base BOM.
+        Thin wrapper around the order-level sale.order._get_flexible_bom_by_product.
         """
-        # First, check if there's a flexible BOM for this product in the same sale order
-        # Look for flexible BOMs that are linked to sale order lines in this order
-        sale_lines_with_flexible_bom = self.env['sale.order.line'].search([
-            ('order_id', '=', self.order_id.id),
-            ('product_id', '=', product.id),
-            ('flexible_bom_id', '!=', False)
-        ])
-        
-        if sale_lines_with_flexible_bom:
-            flexible_bom = sale_lines_with_flexible_bom[0].flexible_bom_id
-            _logger.info(f"Found flexible BOM {flexible_bom.display_name} for product {product.display_name} in sale order")
-            return flexible_bom
-        
-        # Alternative search: look for flexible BOMs created for this product recently
-        flexible_bom = self.env['mrp.bom'].search([
-            ('product_id', '=', product.id),
-            ('is_flexible_bom', '=', True)
-        ], order='create_date desc', limit=1)
-        
-        if flexible_bom:
-            _logger.info(f"Found recent flexible BOM {flexible_bom.display_name} for product {product.display_name}")
-            return flexible_bom
-        
-        # If no flexible BOM, use base BOM
-        base_bom = self.env['mrp.bom']._bom_find(
-            product,
-            company_id=self.company_id.id,
-            bom_type='phantom'  # Only look for KIT BOMs
-        )
-        
-        if base_bom:
-            _logger.info(f"Using base BOM {base_bom.display_name} for product {product.display_name}")
-        
-        return base_bom
+        bom_by_product = self.order_id._get_flexible_bom_by_product(product)
+        return bom_by_product.get(product, self.env['mrp.bom'])
 
     def _get_all_kit_components(self, product, bom, qty=1.0):
         """
-        Recursively expand BOM to get all leaf components for KIT type BOMs.
-        Returns a list of tuples (component_product, total_quantity)
+        Expand BOM to get all leaf components for KIT type BOMs.
+        The flattened explosion is computed once per (BOM, company) and
+        transaction by mrp.bom._explode_kit_flat, then scaled by qty.
+        qty is expressed in the product's base UoM; returned quantities are
+        in each component's base UoM.
+        Returns a list of tuples (component_product, total_quantity), one per product
         """
-        components = []
-        
         if not bom:
-            _logger.info(f"⚠️ No BOM provided for product {product.display_name}, treating as leaf component")
+            KitTrace.debug("No BOM provided for product %s, treating as leaf component", product.id)
             return [(product, qty)]
         
         # If BOM is not KIT type, return the product itself
         if bom.type != 'phantom':  # phantom = KIT in Odoo
-            _logger.info(f"📋 BOM {bom.display_name} is not KIT type (type: {bom.type}), treating {product.display_name} as leaf")
+            KitTrace.debug("BOM %s is not KIT type (type: %s), treating product %s as leaf", bom.id, bom.type, product.id)
             return [(product, qty)]
         
-        _logger.info(f"🔧 Expanding KIT BOM {bom.display_name} for product {product.display_name} (qty: {qty})")
-        
-        for line in bom.bom_line_ids:
-            component_product = line.product_id
-            component_qty = line.product_qty * qty
-            
-            _logger.info(f"  📦 Component: {component_product.display_name} (qty: {component_qty})")
-            
-            # For sub-components, always use base BOM (since they weren't customized)
-            component_bom = self.env['mrp.bom']._bom_find(
-                component_product,
-                company_id=self.company_id.id,
-                bom_type='phantom'  # Only look for KIT BOMs
-            )
-            
-            if component_bom and component_bom.type == 'phantom':
-                _logger.info(f"    🔧 Component {component_product.display_name} has KIT BOM {component_bom.display_name}, expanding...")
-                # Recursively expand this component's BOM
-                sub_components = self._get_all_kit_components(
-                    component_product, 
-                    component_bom, 
-                    component_qty
-                )
-                components.extend(sub_components)
+        flattened = bom._explode_kit_flat(self.company_id.id)
+        components = self.env['product.product'].browse([product_id for product_id, _qty in flattened])
+        if KitTrace.debug_enabled():
+            for component, (_product_id, qty_per_unit) in zip(components, flattened):
+                KitTrace.debug("  Component %s (qty: %s)", component.display_name, qty_per_unit * qty)
+        return [
+            (component, qty_per_unit * qty)
+            for component, (_product_id, qty_per_unit) in zip(components, flattened)
+        ]
+
+    def _get_kit_base_qty(self):
+        """Ordered quantity of the line in the product's base UoM"""
+        self.ensure_one()
+        return self.product_uom._compute_quantity(self.product_uom_qty, self.product_id.uom_id)
+
+    def _get_kit_bom_by_line(self):
+        """
+        Return the BOM to deliver each line with, as a dict {line: mrp.bom}:
+        the flexible BOM assigned to the line, else the product's base BOM.
+        Flexible BOMs customized for other orders are never used here.
+        """
+        bom_by_line = {}
+        lines_without_bom = self.browse()
+        for line in self:
+            if hasattr(line, 'flexible_bom_id') and line.flexible_bom_id:
+                bom_by_line[line] = line.flexible_bom_id
             else:
-                # This is a leaf component
-                _logger.info(f"    ✅ {component_product.display_name} is leaf component (qty: {component_qty})")
-                components.append((component_product, component_qty))
-        
-        _logger.info(f"🎯 Final components for {product.display_name}: {[(c[0].display_name, c[1]) for c in components]}")
-        return components
+                lines_without_bom |= line
+        # Base BOMs in one _bom_find call per company
+        for company, lines in lines_without_bom.grouped('company_id').items():
+            bom_by_product = self.env['mrp.bom']._bom_find(lines.product_id, company_id=company.id)
+            for line in lines:
+                bom_by_line[line] = bom_by_product.get(line.product_id)
+        return bom_by_line
+
+    def _store_kit_snapshot(self):
+        """
+        Freeze the KIT BOM and exploded components of the lines whose company
+        enabled KIT snapshots, so confirmation and later deliveries reuse
+        them instead of resolving and exploding the BOMs again.
+        """
+        lines = self.filtered(lambda line: line.product_id and line.company_id.kit_snapshot_enabled)
+        if not lines:
+            return
+        bom_by_line = lines._get_kit_bom_by_line()
+        for line in lines:
+            bom = bom_by_line.get(line)
+            snapshot = False
+            if bom and bom.type == 'phantom':
+                snapshot = {
+                    'bom_id': bom.id,
+                    'components': [
+                        [product_id, qty_per_unit]
+                        for product_id, qty_per_unit in bom._explode_kit_flat(line.company_id.id)
+                    ],
+                }
+            if snapshot or line.kit_snapshot:
+                line.kit_snapshot = snapshot
+
+    def _get_kit_snapshot_components(self, qty):
+        """Components of the KIT snapshot of the line for qty base units"""
+        self.ensure_one()
+        components = self.kit_snapshot['components']
+        products = self.env['product.product'].browse([product_id for product_id, _qty in components])
+        return [
+            (product, qty_per_unit * qty)
+            for product, (_product_id, qty_per_unit) in zip(products, components)
+        ]
+
+    def _get_kit_components_by_line(self):
+        """
+        Leaf components of the KIT lines, as a dict {line: [(product, qty in
+        base UoM), ...]}. Lines with a KIT snapshot use it as is; lines that
+        are not KITs, or whose KIT has no components, are left out.
+        """
+        snapshot_lines = self.filtered('kit_snapshot')
+        bom_by_line = (self - snapshot_lines)._get_kit_bom_by_line()
+        components_by_line = {}
+        traces = {}
+        for line in self:
+            if line.kit_snapshot:
+                bom = self.env['mrp.bom'].browse(line.kit_snapshot['bom_id'])
+            else:
+                bom = bom_by_line.get(line)
+                if not bom or bom.type != 'phantom':  # phantom = KIT in Odoo
+                    continue
+            if line.company_id not in traces:
+                traces[line.company_id] = KitTrace(line.company_id)
+            with traces[line.company_id].line(line, bom) as stats:
+                qty = line._get_kit_base_qty()
+                if line.kit_snapshot:
+                    components = line._get_kit_snapshot_components(qty)
+                else:
+                    # Reuse the KIT preview computed during BOM customization, or
+                    # get all leaf components from the BOM (flexible or base)
+                    components = line._get_kit_preview_components(bom, qty) or \
+                        line._get_all_kit_components(line.product_id, bom, qty)
+                stats['components'] = len(components)
+            if components:
+                components_by_line[line] = components
+            else:
+                _logger.info("No components found in KIT BOM %s", bom.id)
+        return components_by_line
 
-    def _action_launch_stock_rule(self):
+    def _action_launch_stock_rule(self, previous_product_uom_qty=False):
         """
         Override to handle KIT BOM expansion for deliveries.
         When a product has a KIT BOM with sub-KIT components, 
         create delivery for all leaf components instead.
         Uses flexible BOM if available, otherwise uses base BOM.
+        Works on the whole recordset: KIT lines are delivered through one
+        picking per order, warehouse and shipping partner, the other lines
+        go through the standard stock rules.
+        Like the standard method, only confirmed lines are delivered, and
+        only for the components not already in a delivery (quantity
+        increases on a confirmed line); decreases are left to the user.
         """
-        _logger.info(f"Launching stock rule for sale line {self.id} - Product: {self.product_id.display_name}")
+        _logger.debug("Launching stock rule for %s sale lines", len(self))
         
-        # First priority: Check if this sale line has a flexible BOM assigned
-        bom = None
-        if hasattr(self, 'flexible_bom_id') and self.flexible_bom_id:
-            bom = self.flexible_bom_id
-            _logger.info(f"✅ Using assigned flexible BOM: {bom.display_name} (ID: {bom.id})")
-        else:
-            # Fallback: Get the base BOM for this product
-            bom = self.env['mrp.bom']._bom_find(
-                self.product_id,
-                company_id=self.company_id.id
-            )
-            if bom:
-                _logger.info(f"⚠️ No flexible BOM found, using base BOM: {bom.display_name}")
-            else:
-                _logger.info(f"❌ No BOM found for product {self.product_id.display_name}")
-        
-        if bom and bom.type == 'phantom':  # KIT BOM
-            _logger.info(f"🔧 Processing KIT BOM {bom.display_name} for product {self.product_id.display_name}")
-            
-            # Get all leaf components from the BOM (flexible or base)
-            all_components = self._get_all_kit_components(
-                self.product_id, 
-                bom, 
-                self.product_uom_qty
-            )
+        with record_phase(self.env, 'launch_stock_rule', self.order_id) as launch_stats:
+            with record_phase(self.env, 'kit_explosion', self.order_id) as explosion_stats:
+                components_by_line = self.filtered(lambda line: line.state == 'sale')._get_kit_components_by_line()
+                explosion_stats['components'] = sum(len(components) for components in components_by_line.values())
+            launch_stats['components'] = explosion_stats['components']
+            standard_lines = self.filtered(lambda line: line not in components_by_line)
             
-            if all_components:
-                _logger.info(f"📦 Expanded KIT to {len(all_components)} leaf components: {[c[0].display_name for c in all_components]}")
-                
+            components_by_line = self._get_kit_components_to_deliver(components_by_line)
+            if components_by_line:
+                _logger.debug("Expanded %s KIT lines into leaf component deliveries", len(components_by_line))
                 # Create stock moves for each leaf component instead of the main product
-                self._create_kit_stock_moves(all_components)
-                return
-            else:
-                _logger.info("⚠️ No components found in KIT BOM")
-        elif bom:
-            _logger.info(f"📋 BOM {bom.display_name} is not a KIT (type: {bom.type}), using standard behavior")
-        
-        # If not a KIT or no BOM, use standard behavior
-        _logger.info("🔄 Using standard stock rule behavior")
-        return super()._action_launch_stock_rule()
+                self._create_kit_stock_moves(components_by_line)
+            
+            if not standard_lines:
+                return True
+            # If not a KIT or no BOM, use standard behavior
+            return super(SaleOrderLine, standard_lines)._action_launch_stock_rule(
+                previous_product_uom_qty=previous_product_uom_qty
+            )
+
+    def _get_kit_components_to_deliver(self, components_by_line):
+        """
+        Subtract from the components of each KIT line what its non-cancelled
+        stock moves already deliver (net of returns to refund), as in
+        _get_qty_procurement. Returns the same dict with only the positive
+        remaining quantities; lines with nothing left are dropped.
+        """
+        lines = self.browse([line.id for line in components_by_line])
+        delivered = defaultdict(float)
+        Move = self.env['stock.move'].sudo()
+        base_domain = [('sale_line_id', 'in', lines.ids), ('state', '!=', 'cancel')]
+        for sign, domain in (
+            (1, [('location_dest_id.usage', '=', 'customer')]),
+            (-1, [('location_id.usage', '=', 'customer'), ('to_refund', '=', True)]),
+        ):
+            for line, product, qty in Move._read_group(
+                base_domain + domain, ['sale_line_id', 'product_id'], ['product_qty:sum'],
+            ):
+                delivered[line.id, product.id] += sign * qty
+        if not delivered:
+            return components_by_line
+        remaining_by_line = {}
+        for line, components in components_by_line.items():
+            remaining = []
+            for product, qty in components:
+                qty -= delivered.get((line.id, product.id), 0.0)
+                if float_compare(qty, 0.0, precision_rounding=product.uom_id.rounding) > 0:
+                    remaining.append((product, qty))
+            if remaining:
+                remaining_by_line[line] = remaining
+        return remaining_by_line
 
-    def _create_kit_stock_moves(self, components):
+    def _create_kit_stock_moves(self, components_by_line):
         """
         Create stock moves for KIT components.
-        components: list of tuples (product, quantity)
+        components_by_line: dict {sale.order.line: [(product, quantity in base UoM), ...]}
+        Lines are grouped into one picking per order, warehouse and shipping
+        partner; all moves are created at once and keep their sale_line_id.
         """
-        _logger.info(f"Creating stock moves for {len(components)} KIT components")
+        # Group KIT lines by the picking they belong to
+        lines_by_picking = {}
+        for line, components in components_by_line.items():
+            order = line.order_id
+            warehouse = order._get_warehouse()
+            if not warehouse:
+                _logger.error("No warehouse found for sale order %s", order.name)
+                continue
+            key = (order, warehouse, order.partner_shipping_id)
+            lines_by_picking.setdefault(key, []).append((line, components))
+        if not lines_by_picking:
+            return self.env['stock.picking']
         
-        # Get the warehouse and location info
-        warehouse = self.order_id._get_warehouse()
-        if not warehouse:
-            _logger.error("No warehouse found for sale order")
-            return
-        
-        # Group components by product to avoid duplicates
-        component_dict = {}
-        for product, qty in components:
-            if product.id in component_dict:
-                component_dict[product.id]['qty'] += qty
-            else:
-                component_dict[product.id] = {
-                    'product': product,
-                    'qty': qty
-                }
-        
-        # Create a delivery order for the components
-        picking_vals = {
-            'partner_id': self.order_id.partner_shipping_id.id,
-            'picking_type_id': warehouse.out_type_id.id,
-            'location_id': warehouse.out_type_id.default_location_src_id.id,
-            'location_dest_id': self.order_id.partner_shipping_id.property_stock_customer.id,
-            'origin': self.order_id.name,
-            'move_type': 'direct',
-        }
+        # Create a delivery order per group
+        picking_vals_list = []
+        for order, warehouse, partner in lines_by_picking:
+            picking_vals_list.append({
+                'partner_id': partner.id,
+                'picking_type_id': warehouse.out_type_id.id,
+                'location_id': warehouse.out_type_id.default_location_src_id.id,
+                'location_dest_id': partner.property_stock_customer.id,
+                'origin': order.name,
+                'move_type': 'direct',
+            })
+        pickings = self.env['stock.picking'].create(picking_vals_list)
         
-        picking = self.env['stock.picking'].create(picking_vals)
-        _logger.info(f"Created picking {picking.name} for KIT components")
+        move_vals_list = []
+        for picking, ((order, warehouse, partner), line_components) in zip(pickings, lines_by_picking.items()):
+            for line, components in line_components:
+                # Components are already summed per product by the explosion
+                for product, qty in components:
+                    move_vals_list.append({
+                        'name': f"{order.name} - {product.display_name}",
+                        'product_id': product.id,
+                        'product_uom_qty': qty,
+                        'product_uom': product.uom_id.id,
+                        'picking_id': picking.id,
+                        'location_id': warehouse.out_type_id.default_location_src_id.id,
+                        'location_dest_id': partner.property_stock_customer.id,
+                        'sale_line_id': line.id,
+                        'origin': order.name,
+                    })
         
-        # Create stock moves for each component
-        for component_data in component_dict.values():
-            product = component_data['product']
-            qty = component_data['qty']
-            
-            move_vals = {
-                'name': f"{self.order_id.name} - {product.display_name}",
-                'product_id': product.id,
-                'product_uom_qty': qty,
-                'product_uom': product.uom_id.id,
-                'picking_id': picking.id,
-                'location_id': warehouse.out_type_id.default_location_src_id.id,
-                'location_dest_id': self.order_id.partner_shipping_id.property_stock_customer.id,
-                'sale_line_id': self.id,
-                'origin': self.order_id.name,
-            }
-            
-            move = self.env['stock.move'].create(move_vals)
-            _logger.info(f"Created stock move for {product.display_name} - Qty: {qty}")
+        with record_phase(self.env, 'create_kit_moves', self.order_id) as stats:
+            self.env['stock.move'].create(move_vals_list)
+            stats['components'] = len(move_vals_list)
+        _logger.debug("Created %s pickings with %s stock moves for KIT components", len(pickings), len(move_vals_list))
         
-        # Confirm the picking to make it available
-        picking.action_confirm()
-        _logger.info(f"Confirmed picking {picking.name}")
+        # Confirm the pickings to make them available
+        with record_phase(self.env, 'picking_confirm', self.order_id) as stats:
+            pickings.action_confirm()
+            stats['components'] = len(move_vals_list)
+        return pickings
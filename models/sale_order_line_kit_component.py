@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class SaleOrderLineKitComponent(models.Model):
+    """
+    Leaf component of a KIT sale order line, kept up to date while the
+    order is in BOM customization and reused at confirmation.
+    """
+    _name = 'sale.order.line.kit.component'
+    _description = 'Sale Order Line KIT Component'
+    _order = 'line_id, id'
+
+    line_id = fields.Many2one('sale.order.line', string='Order Line', required=True, index=True, ondelete='cascade')
+    order_id = fields.Many2one(related='line_id.order_id', store=True, index=True)
+    kit_product_id = fields.Many2one(related='line_id.product_id', string='KIT')
+    product_id = fields.Many2one('product.product', string='Component', required=True)
+    product_uom_qty = fields.Float(string='Quantity', digits='Product Unit of Measure')
+    product_uom_id = fields.Many2one(related='product_id.uom_id', string='Unit')
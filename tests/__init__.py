@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from . import test_confirm_jobs
+from . import test_flexible_bom_indexes
+from . import test_flexible_bom_resolution
+from . import test_kit_benchmark
+from . import test_kit_flattened
+from . import test_kit_preview
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo import Command
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import mute_logger
+from psycopg2 import errors as pg_errors
+
+
+@tagged('post_install', '-at_install')
+class TestConfirmJobs(TransactionCase):
+    """Mass confirmation through background jobs, one transaction per order"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.partner = cls.env['res.partner'].create({'name': "Batch Confirmation Customer"})
+        cls.product = cls.env['product.product'].create({'name': "Batch Confirmation Product", 'type': 'consu'})
+        cls.orders = cls.env['sale.order'].create([{
+            'partner_id': cls.partner.id,
+            'order_line': [Command.create({'product_id': cls.product.id})],
+        } for _index in range(3)])
+        cls.orders.action_approve_order()
+        cls.orders.action_customize_bom()
+        cls.quotation = cls.env['sale.order'].create({
+            'partner_id': cls.partner.id,
+            'order_line': [Command.create({'product_id': cls.product.id})],
+        })
+
+    def _patch_action_confirm(self, side_effect):
+        """Run side_effect(order) before each order confirmation"""
+        SaleOrder = type(self.env['sale.order'])
+        action_confirm = SaleOrder.action_confirm
+
+        def patched_action_confirm(orders):
+            side_effect(orders)
+            return action_confirm(orders)
+        return patch.object(SaleOrder, 'action_confirm', patched_action_confirm)
+
+    def test_batch_queues_then_confirms_each_order(self):
+        missing_id = 10 ** 9
+        results = self.env['sale.order'].confirm_orders_batch(self.orders.ids + [self.quotation.id, missing_id])
+        self.assertEqual([result['success'] for result in results], [True, True, True, False, False])
+        self.assertEqual(set(self.orders.mapped('async_confirm_state')), {'queued'})
+        self.assertEqual(len(self.orders.confirm_job_ids), 3)
+        # Queued orders are not queued twice
+        self.assertFalse(self.env['sale.order'].confirm_orders_batch(self.orders[:1].ids)[0]['success'])
+
+        self.env['sale.order.confirm.job']._cron_process_jobs()
+        self.assertEqual(set(self.orders.mapped('state')), {'sale'})
+        self.assertEqual(set(self.orders.confirm_job_ids.mapped('state')), {'done'})
+        self.assertFalse(any(self.orders.mapped('async_confirm_state')))
+
+    def test_failure_does_not_affect_other_orders(self):
+        failing = self.orders[1]
+
+        def fail(orders):
+            if orders == failing:
+                raise UserError("Boom")
+        self.env['sale.order'].confirm_orders_batch(self.orders.ids)
+        with self._patch_action_confirm(fail), \
+             mute_logger('odoo.addons.sale_order_approval.models.sale_order_confirm_job'):
+            self.env['sale.order.confirm.job']._cron_process_jobs()
+        self.assertEqual(failing.state, 'bom_customization')
+        self.assertEqual(failing.async_confirm_state, 'failed')
+        self.assertEqual(failing.confirm_job_ids.state, 'failed')
+        self.assertEqual(set((self.orders - failing).mapped('state')), {'sale'})
+
+    def test_serialization_failure_is_retried(self):
+        calls = []
+
+        def fail_once(orders):
+            calls.append(orders.id)
+            if len(calls) == 1:
+                raise pg_errors.SerializationFailure("could not serialize access due to concurrent update")
+        order = self.orders[0]
+        self.env['sale.order'].confirm_orders_batch(order.ids)
+        with self._patch_action_confirm(fail_once):
+            self.env['sale.order.confirm.job']._cron_process_jobs()
+        self.assertEqual(calls, [order.id, order.id])
+        self.assertEqual(order.state, 'sale')
+        self.assertEqual(order.confirm_job_ids.attempt_count, 1)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import SQL
+
+
+@tagged('post_install', '-at_install')
+class TestFlexibleBomIndexes(TransactionCase):
+    """The flexible BOM lookups of the order resolver are served by their partial indexes"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.products = cls.env['product.product'].create([
+            {'name': f"Indexed Product {index}", 'type': 'consu'} for index in range(20)
+        ])
+        cls.order = cls.env['sale.order'].create({
+            'partner_id': cls.env['res.partner'].create({'name': "Indexed Customer"}).id,
+            'order_line': [
+                Command.create({'product_id': product.id}) for _copy in range(3) for product in cls.products
+            ],
+        })
+
+    def _explain(self, model, domain):
+        """Plan of the ORM search for domain, with sequential scans discouraged"""
+        cr = self.env.cr
+        self.env.flush_all()
+        cr.execute(SQL("ANALYZE %s", SQL.identifier(model._table)))
+        cr.execute("SET LOCAL enable_seqscan = off")
+        self.addCleanup(cr.execute, "SET LOCAL enable_seqscan = on")
+        cr.execute(SQL("EXPLAIN %s", model._search(domain).select()))
+        return "\n".join(row[0] for row in cr.fetchall())
+
+    def test_order_flexible_lines_use_partial_index(self):
+        SaleOrderLine = self.env['sale.order.line']
+        domain = [
+            ('order_id', '=', self.order.id),
+            ('product_id', 'in', self.products.ids),
+            ('has_flexible_bom', '=', True),
+        ]
+        if 'flexible_bom_id' in SaleOrderLine._fields:
+            domain.append(('flexible_bom_id', '!=', False))
+        self.assertIn('sale_order_line_flexible_bom_order_product_index', self._explain(SaleOrderLine, domain))
+
+    def test_latest_flexible_bom_uses_partial_index(self):
+        Bom = self.env['mrp.bom']
+        if 'is_flexible_bom' not in Bom._fields:
+            self.skipTest("is_flexible_bom is not installed")
+        domain = [('product_id', 'in', self.products.ids), ('is_flexible_bom', '=', True)]
+        self.assertIn('mrp_bom_flexible_product_id_index', self._explain(Bom, domain))
+
+    def test_has_flexible_bom_follows_flexible_bom(self):
+        SaleOrderLine = self.env['sale.order.line']
+        if 'flexible_bom_id' not in SaleOrderLine._fields:
+            self.skipTest("flexible_bom_id is not installed")
+        product = self.products[0]
+        bom = self.env['mrp.bom'].create({
+            'product_tmpl_id': product.product_tmpl_id.id,
+            'product_id': product.id,
+            'type': 'phantom',
+        })
+        line = self.order.order_line[0]
+        line.flexible_bom_id = bom
+        self.assertTrue(line.has_flexible_bom)
+        bom.unlink()
+        self.assertFalse(line.flexible_bom_id)
+        self.assertFalse(self.order._get_flexible_bom_by_product(product).get(product))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestFlexibleBomResolution(TransactionCase):
+    """BOM resolution of sale order lines, per order and at delivery"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.partner = cls.env['res.partner'].create({'name': "Flexible BOM Customer"})
+        cls.component = Product.create({'name': "Flexible BOM Component", 'type': 'consu'})
+        cls.kit = Product.create({'name': "Flexible BOM Kit", 'type': 'consu'})
+        cls.other_kit = Product.create({'name': "Flexible BOM Other Kit", 'type': 'consu'})
+        cls.base_bom = cls._create_kit_bom(cls.kit)
+        cls.other_base_bom = cls._create_kit_bom(cls.other_kit)
+        cls.order = cls.env['sale.order'].create({
+            'partner_id': cls.partner.id,
+            'order_line': [
+                Command.create({'product_id': product.id})
+                for product in (cls.kit, cls.other_kit, cls.component)
+            ],
+        })
+
+    @classmethod
+    def _create_kit_bom(cls, product, **vals):
+        return cls.env['mrp.bom'].create(dict({
+            'product_tmpl_id': product.product_tmpl_id.id,
+            'product_id': product.id,
+            'type': 'phantom',
+            'bom_line_ids': [Command.create({'product_id': cls.component.id, 'product_qty': 2.0})],
+        }, **vals))
+
+    def _find_bom_per_product(self, product):
+        """The per-product lookup the order-level resolver replaces"""
+        Bom = self.env['mrp.bom']
+        if 'flexible_bom_id' in self.env['sale.order.line']._fields:
+            lines = self.env['sale.order.line'].search([
+                ('order_id', '=', self.order.id),
+                ('product_id', '=', product.id),
+                ('flexible_bom_id', '!=', False),
+            ])
+            if lines:
+                return lines[0].flexible_bom_id
+        if 'is_flexible_bom' in Bom._fields:
+            flexible_bom = Bom.search([
+                ('product_id', '=', product.id),
+                ('is_flexible_bom', '=', True),
+            ], order='create_date desc, id desc', limit=1)
+            if flexible_bom:
+                return flexible_bom
+        return Bom._bom_find(product, company_id=self.order.company_id.id, bom_type='phantom')[product]
+
+    def _assert_matches_per_product(self):
+        products = self.order.order_line.product_id
+        bom_by_product = self.order._get_flexible_bom_by_product(products)
+        for product in products:
+            self.assertEqual(
+                bom_by_product.get(product, self.env['mrp.bom']), self._find_bom_per_product(product),
+                f"BOM of {product.display_name}",
+            )
+
+    def test_resolver_matches_per_product_lookup(self):
+        self._assert_matches_per_product()
+        if 'is_flexible_bom' not in self.env['mrp.bom']._fields:
+            return
+        # The most recent flexible BOM of a product wins
+        self._create_kit_bom(self.kit, is_flexible_bom=True)
+        self._create_kit_bom(self.kit, is_flexible_bom=True)
+        self._assert_matches_per_product()
+        if 'flexible_bom_id' not in self.env['sale.order.line']._fields:
+            return
+        # Then a flexible BOM set on a line of the order
+        line = self.order.order_line.filtered(lambda line: line.product_id == self.other_kit)
+        line.flexible_bom_id = self._create_kit_bom(self.other_kit, is_flexible_bom=True)
+        self._assert_matches_per_product()
+
+    def test_delivery_uses_base_bom_without_line_flexible_bom(self):
+        if 'is_flexible_bom' in self.env['mrp.bom']._fields:
+            # Customized for another customer's order
+            self._create_kit_bom(self.kit, is_flexible_bom=True)
+        bom_by_line = self.order.order_line._get_kit_bom_by_line()
+        kit_line = self.order.order_line.filtered(lambda line: line.product_id == self.kit)
+        component_line = self.order.order_line.filtered(lambda line: line.product_id == self.component)
+        self.assertEqual(bom_by_line[kit_line], self.base_bom)
+        self.assertFalse(bom_by_line[component_line])
+
+    def test_delivery_uses_line_flexible_bom(self):
+        if 'flexible_bom_id' not in self.env['sale.order.line']._fields:
+            self.skipTest("flexible_bom_id is not installed")
+        flexible_bom = self._create_kit_bom(self.kit)
+        kit_line = self.order.order_line.filtered(lambda line: line.product_id == self.kit)
+        kit_line.flexible_bom_id = flexible_bom
+        self.assertEqual(self.order.order_line._get_kit_bom_by_line()[kit_line], flexible_bom)
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import TransactionCase, tagged
+import json
+import logging
+import os
+import time
+
+from ..models.mrp_bom import MrpBom as ApprovalMrpBom
+
+_logger = logging.getLogger(__name__)
+
+# Shapes of the synthetic KIT trees as (depth, breadth), e.g. KIT_BENCHMARK_TREES="2:10,4:3"
+TREE_SHAPES = [
+    tuple(int(value) for value in shape.split(':'))
+    for shape in os.environ.get('KIT_BENCHMARK_TREES', '2:10,4:3,8:2').split(',')
+]
+# Number of lines of the benchmarked orders, e.g. KIT_BENCHMARK_ORDER_SIZES="1,10,100,500"
+ORDER_SIZES = [int(size) for size in os.environ.get('KIT_BENCHMARK_ORDER_SIZES', '1,10,100,500').split(',')]
+# Orders approved at once by the mass approval benchmark
+MASS_APPROVAL_SIZE = int(os.environ.get('KIT_BENCHMARK_APPROVALS', 1000))
+# _bom_find calls per measured scheduler round
+SCHEDULER_ROUNDS = 20
+# Machine-readable results, one JSON document per run; not written when unset
+BENCHMARK_OUTPUT = os.environ.get('KIT_BENCHMARK_OUTPUT')
+
+
+@tagged('-standard', 'post_install', '-at_install', 'kit_benchmark')
+class TestKitBenchmark(TransactionCase):
+    """
+    Query counts and wall time of the KIT explosion, confirmation and
+    _bom_find on synthetic KIT trees and orders. Only runs with
+    --test-tags kit_benchmark; results are written to KIT_BENCHMARK_OUTPUT.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = []
+        cls.company_id = cls.env.company.id
+        cls.partner = cls.env['res.partner'].create({'name': "KIT Benchmark Customer"})
+        cls.leaves = cls.env['product.product'].create([
+            {'name': f"KIT Benchmark Leaf {index}", 'type': 'consu'} for index in range(50)
+        ])
+        cls.kits = []
+        for depth, breadth in TREE_SHAPES:
+            kit, bom = cls._create_kit_tree(f"{depth}x{breadth}", depth, breadth)
+            cls.kits.append((kit, bom, depth, breadth))
+
+    @classmethod
+    def tearDownClass(cls):
+        if BENCHMARK_OUTPUT:
+            with open(BENCHMARK_OUTPUT, 'w') as output:
+                json.dump({
+                    'database': cls.env.cr.dbname,
+                    'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'results': cls.results,
+                }, output, indent=2)
+            _logger.info("KIT benchmark results written to %s", BENCHMARK_OUTPUT)
+        super().tearDownClass()
+
+    @classmethod
+    def _create_kit_tree(cls, name, depth, breadth):
+        """
+        KIT product whose BOM nests depth levels of breadth sub-KITs. Every
+        KIT of a level uses all the KITs of the level below, so sub-KITs are
+        shared (diamonds) and a naive expansion visits breadth ** depth paths.
+        """
+        Product = cls.env['product.product']
+        level = cls.leaves
+        for depth_index in range(depth + 1):
+            size = 1 if depth_index == depth else breadth
+            kits = Product.create([
+                {'name': f"KIT Benchmark {name} L{depth_index} K{index}", 'type': 'consu'} for index in range(size)
+            ])
+            boms = cls.env['mrp.bom'].create([{
+                'product_tmpl_id': kit.product_tmpl_id.id,
+                'product_id': kit.id,
+                'type': 'phantom',
+                'product_qty': 1.0,
+                'bom_line_ids': [
+                    Command.create({
+                        'product_id': level[(index * breadth + offset) % len(level)].id,
+                        'product_qty': 2.0,
+                    })
+                    for offset in range(breadth)
+                ],
+            } for index, kit in enumerate(kits)])
+            level = kits
+        return kits, boms
+
+    def _measure(self, benchmark, func, **params):
+        """Run func, record its wall time and query count, and return its result"""
+        self.env.flush_all()
+        cr = self.env.cr
+        start_queries = cr.sql_log_count
+        start = time.perf_counter()
+        result = func()
+        self.env.flush_all()
+        self.results.append(dict(
+            params,
+            benchmark=benchmark,
+            duration_ms=round((time.perf_counter() - start) * 1000.0, 3),
+            queries=cr.sql_log_count - start_queries,
+        ))
+        return result
+
+    def _count_queries(self, func):
+        """Queries run by func, counted like assertQueryCount: precommit hooks included"""
+        self.env.flush_all()
+        self.env.cr.flush()
+        start_queries = self.env.cr.sql_log_count
+        func()
+        self.env.flush_all()
+        self.env.cr.flush()
+        return self.env.cr.sql_log_count - start_queries
+
+    def _clear_kit_caches(self, stored=True):
+        """Drop the transaction memo and, unless stored is False, the flattened BOMs"""
+        self.env['mrp.bom.flattened']._invalidate()
+        if stored:
+            self.env['mrp.bom.flattened'].sudo().search([]).unlink()
+
+    def _expand_naively(self, bom, qty=1.0):
+        """Leaf quantities of a KIT by plain recursion, as a reference"""
+        leaf_qtys = {}
+        for line in bom.bom_line_ids:
+            sub_bom = self.env['mrp.bom']._bom_find(line.product_id, bom_type='phantom')[line.product_id]
+            if sub_bom:
+                for product_id, sub_qty in self._expand_naively(sub_bom, qty * line.product_qty).items():
+                    leaf_qtys[product_id] = leaf_qtys.get(product_id, 0.0) + sub_qty
+            else:
+                leaf_qtys[line.product_id.id] = leaf_qtys.get(line.product_id.id, 0.0) + qty * line.product_qty
+        return leaf_qtys
+
+    def _create_orders(self, count, line_count):
+        products = [kit for kit, _bom, _depth, _breadth in self.kits]
+        return self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'order_line': [
+                Command.create({'product_id': products[index % len(products)].id, 'product_uom_qty': 1.0})
+                for index in range(line_count)
+            ],
+        } for _order in range(count)])
+
+    def _create_quotations(self, count):
+        """Quotations with a single non-KIT line"""
+        return self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'order_line': [Command.create({'product_id': self.leaves[index % len(self.leaves)].id})],
+        } for index in range(count)])
+
+    def _get_kit_moves(self, order):
+        return self.env['stock.move'].search([('sale_line_id', 'in', order.order_line.ids)])
+
+    def test_explode_kit_trees(self):
+        SaleOrderLine = self.env['sale.order.line']
+        for kit, bom, depth, breadth in self.kits:
+            params = {'depth': depth, 'breadth': breadth}
+            self._clear_kit_caches()
+            components = self._measure('explode_kit_cold', lambda: bom._explode_kit_flat(self.company_id), **params)
+            self.assertEqual(
+                {product_id: round(qty, 6) for product_id, qty in components},
+                {product_id: round(qty, 6) for product_id, qty in self._expand_naively(bom).items()},
+            )
+            self._clear_kit_caches(stored=False)
+            self._measure('explode_kit_stored', lambda: bom._explode_kit_flat(self.company_id), **params)
+            # Memoized until the next cursor flush, commit or rollback
+            with self.assertQueryCount(0, flush=False):
+                bom._explode_kit_flat(self.company_id)
+            self._measure(
+                'get_all_kit_components',
+                lambda: SaleOrderLine._get_all_kit_components(kit, bom, 3.0),
+                **params,
+            )
+
+    def test_bom_find(self):
+        Bom = self.env['mrp.bom']
+        products = self.leaves | self.env['product.product'].search([('name', '=like', 'KIT Benchmark %')])
+        flexible_bom = self.kits[0][1]
+        self._measure('bom_find', lambda: Bom._bom_find(products, bom_type='phantom'), products=len(products))
+        self._measure(
+            'bom_find_flexible_context',
+            lambda: Bom.with_context(flexible_bom_id=flexible_bom.id)._bom_find(products, bom_type='phantom'),
+            products=len(products),
+        )
+        bom_by_product = Bom.with_context(flexible_bom_id=flexible_bom.id)._bom_find(self.kits[0][0])
+        self.assertEqual(bom_by_product[self.kits[0][0]], flexible_bom)
+
+    def _bom_find_without_module(self, products, **kwargs):
+        """_bom_find as it runs without this module: the next override in the MRO"""
+        Bom = self.env['mrp.bom']
+        mro = type(Bom).mro()
+        base = next(
+            cls for cls in mro[mro.index(ApprovalMrpBom) + 1:] if '_bom_find' in vars(cls)
+        )
+        return base._bom_find(Bom, products, **kwargs)
+
+    def test_scheduler_bom_find_throughput(self):
+        """
+        _bom_find as called by the MRP scheduler (no sale context), with and
+        without this module's override, in calls per second.
+        """
+        Bom = self.env['mrp.bom']
+        products = self.leaves | self.env['product.product'].search([('name', '=like', 'KIT Benchmark %')])
+        variants = [
+            ('without_module', lambda: self._bom_find_without_module(products, bom_type='phantom')),
+            ('with_module', lambda: Bom._bom_find(products, bom_type='phantom')),
+        ]
+        for variant, bom_find in variants:
+            bom_find()
+
+            def run_rounds():
+                for _round in range(SCHEDULER_ROUNDS):
+                    self.env.invalidate_all()
+                    bom_find()
+
+            start = time.perf_counter()
+            self._measure('scheduler_bom_find', run_rounds, variant=variant, products=len(products),
+                          rounds=SCHEDULER_ROUNDS)
+            self.results[-1]['calls_per_second'] = round(SCHEDULER_ROUNDS / (time.perf_counter() - start), 1)
+
+        # Outside of a flexible BOM context the override adds no query
+        self.env.invalidate_all()
+        start_queries = self.env.cr.sql_log_count
+        expected = self._bom_find_without_module(products, bom_type='phantom')
+        base_queries = self.env.cr.sql_log_count - start_queries
+        self.env.invalidate_all()
+        with self.assertQueryCount(base_queries):
+            self.assertEqual(Bom._bom_find(products, bom_type='phantom'), expected)
+
+        self._measure('run_scheduler', self.env['procurement.group'].run_scheduler)
+
+    def test_mass_approval(self):
+        """Approvals and BOM customizations per second, through the JSON-RPC batch methods"""
+        SaleOrder = self.env['sale.order']
+        orders = self._create_quotations(MASS_APPROVAL_SIZE)
+        for benchmark, method in (
+            ('approve_orders_batch', SaleOrder.approve_orders_batch),
+            ('customize_bom_orders_batch', SaleOrder.customize_bom_orders_batch),
+        ):
+            self.env.invalidate_all()
+            start = time.perf_counter()
+            results = self._measure(benchmark, lambda: method(orders.ids), orders=MASS_APPROVAL_SIZE)
+            self.results[-1]['orders_per_second'] = round(MASS_APPROVAL_SIZE / (time.perf_counter() - start), 1)
+            self.assertTrue(all(result['success'] for result in results))
+        self._measure('log_workflow_messages', self.env.cr.precommit.run, orders=MASS_APPROVAL_SIZE)
+        self.assertEqual(set(orders.mapped('state')), {'bom_customization'})
+
+        # The transitions are set-based: ten times more orders, no more queries.
+        # State tracking logs one message per order, so it is left out.
+        small, large = self._create_quotations(10), self._create_quotations(100)
+        small, large = small.with_context(tracking_disable=True), large.with_context(tracking_disable=True)
+        self.env.invalidate_all()
+        small_queries = self._count_queries(small.action_approve_order)
+        self.assertEqual(set(small.mapped('state')), {'approved'})
+        self.env.invalidate_all()
+        with self.assertQueryCount(small_queries):
+            large.action_approve_order()
+        self.assertEqual(set(large.mapped('state')), {'approved'})
+
+    def test_confirm_orders(self):
+        for line_count in ORDER_SIZES:
+            params = {'lines': line_count}
+            self._clear_kit_caches()
+            confirmed, launched = self._create_orders(2, line_count)
+            (confirmed | launched).action_approve_order()
+            self._measure('customize_bom', (confirmed | launched).action_customize_bom, orders=2, **params)
+            self._measure('action_confirm', confirmed.action_confirm, **params)
+            self.assertEqual(confirmed.state, 'sale')
+            self.assertTrue(self._get_kit_moves(confirmed))
+
+            # Launch the stock rules alone, on an order already in 'sale'
+            self._clear_kit_caches()
+            launched.write({'state': 'sale'})
+            self._measure('action_launch_stock_rule', launched.order_line._action_launch_stock_rule, **params)
+            self.assertTrue(self._get_kit_moves(launched))
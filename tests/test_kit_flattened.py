@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import TransactionCase, tagged
+
+from ..models.mrp_bom_flattened import FLATTENED_VERSION
+
+
+@tagged('post_install', '-at_install')
+class TestKitFlattened(TransactionCase):
+    """Stored KIT explosions are never served once one of their BOMs changed"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.component = Product.create({'name': "Flattened Component", 'type': 'consu'})
+        cls.sub_component = Product.create({'name': "Flattened Sub-component", 'type': 'consu'})
+        cls.kit = Product.create({'name': "Flattened Kit", 'type': 'consu'})
+        cls.bom = cls.env['mrp.bom'].create({
+            'product_tmpl_id': cls.kit.product_tmpl_id.id,
+            'product_id': cls.kit.id,
+            'type': 'phantom',
+            'bom_line_ids': [Command.create({'product_id': cls.component.id, 'product_qty': 2.0})],
+        })
+
+    def _get_rows(self):
+        return self.env['mrp.bom.flattened'].sudo().search([('bom_id', '=', self.bom.id)])
+
+    def _explode(self):
+        """Explode the KIT without the transaction memo"""
+        self.env['mrp.bom.flattened']._invalidate()
+        return self.bom._explode_kit_flat()
+
+    def test_concurrent_edit_rejects_stored_explosion(self):
+        Flattened = self.env['mrp.bom.flattened']
+        self._explode()
+        self.assertIn(self.bom.id, Flattened._get_entries(self.bom))
+        # An edit committed by another transaction bumps the revision, but
+        # cannot see (and delete) the row this one stored
+        Flattened._bump_bom_revisions({self.bom.id}, ())
+        self.assertNotIn(self.bom.id, Flattened._get_entries(self.bom))
+        # Exploding again replaces the rejected row
+        self._explode()
+        self.assertEqual(len(self._get_rows()), 1)
+        self.assertIn(self.bom.id, Flattened._get_entries(self.bom))
+
+    def test_new_sub_kit_bumps_parent_revision(self):
+        revision = self.bom.kit_revision
+        self.env['mrp.bom'].create({
+            'product_tmpl_id': self.component.product_tmpl_id.id,
+            'product_id': self.component.id,
+            'type': 'phantom',
+            'bom_line_ids': [Command.create({'product_id': self.sub_component.id, 'product_qty': 3.0})],
+        })
+        self.assertGreater(self.bom.kit_revision, revision)
+        self.assertEqual(self._explode(), ((self.sub_component.id, 6.0),))
+
+    def test_store_replaces_older_versions(self):
+        self.env['mrp.bom.flattened'].sudo().create({
+            'bom_id': self.bom.id,
+            'components': [[self.component.id, 1.0]],
+            'component_count': 1,
+            'version': FLATTENED_VERSION - 1,
+        })
+        self.assertEqual(self._explode(), ((self.component.id, 2.0),))
+        self.assertEqual(self._get_rows().mapped('version'), [FLATTENED_VERSION])
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestKitPreview(TransactionCase):
+    """The KIT preview lives while the order is in BOM customization"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.component = Product.create({'name': "Preview Component", 'type': 'consu'})
+        cls.kit = Product.create({'name': "Preview Kit", 'type': 'consu'})
+        cls.env['mrp.bom'].create({
+            'product_tmpl_id': cls.kit.product_tmpl_id.id,
+            'product_id': cls.kit.id,
+            'type': 'phantom',
+            'bom_line_ids': [Command.create({'product_id': cls.component.id, 'product_qty': 2.0})],
+        })
+        cls.order = cls.env['sale.order'].create({
+            'partner_id': cls.env['res.partner'].create({'name': "Preview Customer"}).id,
+            'order_line': [Command.create({'product_id': cls.kit.id, 'product_uom_qty': 3.0})],
+        })
+        cls.order.action_approve_order()
+        cls.order.action_customize_bom()
+
+    def _get_preview(self):
+        return self.env['sale.order.line.kit.component'].search([('order_id', '=', self.order.id)])
+
+    def test_preview_dropped_after_confirmation(self):
+        self.assertEqual(self._get_preview().mapped('product_uom_qty'), [6.0])
+        self.order.action_confirm()
+        moves = self.env['stock.move'].search([('sale_line_id', 'in', self.order.order_line.ids)])
+        self.assertEqual(moves.product_id, self.component)
+        self.env.cr.flush()
+        self.assertFalse(self._get_preview())
+
+    def test_preview_dropped_on_direct_state_write(self):
+        self.order.write({'state': 'sale'})
+        self.env.cr.flush()
+        self.assertFalse(self._get_preview())
+        self.assertFalse(self.order.order_line.kit_preview_bom_id)
+
+    def test_preview_dropped_when_going_back(self):
+        self.order.with_context(disable_cancel_warning=True).action_cancel()
+        self.assertEqual(self.order.state, 'cancel')
+        self.assertFalse(self._get_preview())
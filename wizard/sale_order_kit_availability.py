@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class SaleOrderKitAvailability(models.TransientModel):
+    """Shortage report of the leaf components of one or many orders"""
+    _name = 'sale.order.kit.availability'
+    _description = 'KIT Component Availability Check'
+
+    order_ids = fields.Many2many('sale.order', string='Orders')
+    line_ids = fields.One2many('sale.order.kit.availability.line', 'wizard_id', string='Shortages')
+    shortage_order_count = fields.Integer(string='Orders with Shortages')
+
+
+class SaleOrderKitAvailabilityLine(models.TransientModel):
+    _name = 'sale.order.kit.availability.line'
+    _description = 'KIT Component Shortage'
+    _order = 'order_id, product_id'
+
+    wizard_id = fields.Many2one('sale.order.kit.availability', required=True, ondelete='cascade')
+    order_id = fields.Many2one('sale.order', string='Order')
+    warehouse_id = fields.Many2one('stock.warehouse', string='Warehouse')
+    product_id = fields.Many2one('product.product', string='Component')
+    product_uom_id = fields.Many2one(related='product_id.uom_id', string='Unit')
+    demand_qty = fields.Float(string='Demand', digits='Product Unit of Measure')
+    available_qty = fields.Float(string='Available', digits='Product Unit of Measure')
+    shortage_qty = fields.Float(string='Shortage', digits='Product Unit of Measure')